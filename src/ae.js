@@ -278,6 +278,174 @@ var MASK14B = 0x3FFF ; // 11111111111111
 var MASK15B = 0x7FFF ; // 111111111111111
 var MASK16B = 0xFFFF ; // 1111111111111111
 
+/* OPCODE LUT */
+var LUT_URL = "media/lut.bin"; // written by `src/genlut.py --binary media/lut.bin`
+var LUT     = null;
+/**
+ * The opcode LUT is generated by genlut.py and fetched as one ArrayBuffer.  The header
+ * (see "Binary artifact" in genlut.py) is read with a DataView, and every section after it
+ * is wrapped in a typed array of the right type, so nothing else needs to be parsed.
+ *
+ * LUT.sections.OPID[ opcode ] is the family id of an opcode (0 if it isn't assigned) and
+ * LUT.families[ id ] is that family's name and major opcode.  lut_family() gets the same id
+ * from the much smaller two-level PIDX/PAGE tables.
+ */
+var LUT_MAGIC   = 0x544C4541; // "AELT", read as a little-endian Uint32
+var LUT_VERSION = 1;
+
+var LUT_TYPED_ARRAYS = {
+    "B" : Uint8Array,
+    "b" : Int8Array,
+    "H" : Uint16Array,
+    "h" : Int16Array,
+    "I" : Uint32Array,
+    "i" : Int32Array
+};
+
+function parse_lut( _buffer ) {
+    var header   = new DataView( _buffer );
+    var sections = {};
+    var families = [];
+    var i, j;
+
+    if( header.getUint32( 0, true ) !== LUT_MAGIC ) {
+        throw new Error( "not an AEJS opcode LUT" );
+    }
+    if( header.getUint16( 4, true ) !== LUT_VERSION ) {
+        throw new Error( "unsupported LUT version " + header.getUint16( 4, true ) );
+    }
+
+    var family_count  = header.getUint16( 8, true );
+    var section_count = header.getUint16( 10, true );
+
+    for( i = 0; i < section_count; i++ ) {
+        var entry  = 32 + 16 * i;
+        var tag    = String.fromCharCode( header.getUint8( entry ), header.getUint8( entry + 1 ),
+                                          header.getUint8( entry + 2 ), header.getUint8( entry + 3 ) );
+        var type   = String.fromCharCode( header.getUint8( entry + 4 ) );
+        var offset = header.getUint32( entry + 8, true );
+        var count  = header.getUint32( entry + 12, true );
+
+        sections[ tag ] = new LUT_TYPED_ARRAYS[ type ]( _buffer, offset, count );
+    }
+
+    // the family table is only needed for names, so it's unpacked once here
+    var fams = sections.FAMS;
+    for( i = 0, j = 0; i < family_count; i++ ) {
+        var major = fams[ j ];
+        var name  = String.fromCharCode.apply( null, fams.subarray( j + 2, j + 2 + fams[ j + 1 ] ) );
+        j += 2 + fams[ j + 1 ];
+
+        families.push( { name : name || null, major : major === 255 ? null : major } );
+    }
+
+    // PIDX has one entry per page, so its length gives the number of bits it's indexed on
+    var page_shift = 16 - Math.round( Math.log( sections.PIDX.length ) / Math.LN2 );
+
+    return {
+        hash       : new Uint8Array( _buffer, 12, 20 ),
+        families   : families,
+        sections   : sections,
+        page_shift : page_shift,
+        page_mask  : ( 1 << page_shift ) - 1
+    };
+}
+
+/**
+ * LUT.sections.OPND[ opcode ] is the pre-decoded operand word of an opcode, laid out as
+ * OPERAND_FIELDS in genlut.py says.  These are the shifts and masks of its fields.
+ */
+var OPND_ID_SHIFT       =  0; // MASK8B
+var OPND_SIZE_SHIFT     =  8; // MASK2B, 0 byte, 1 word, 2 long, 3 unsized
+var OPND_EA_MODE_SHIFT  = 10; // MASK3B
+var OPND_EA_REG_SHIFT   = 13; // MASK3B
+var OPND_DST_MODE_SHIFT = 16; // MASK3B
+var OPND_DST_REG_SHIFT  = 19; // MASK3B
+var OPND_DATA_SHIFT     = 10; // MASK8B, only for families with no effective address
+var OPND_REG_SHIFT      = 22; // MASK3B
+var OPND_REG2_SHIFT     = 25; // MASK3B
+var OPND_OPMODE_SHIFT   = 28; // MASK4B, also the condition
+
+/**
+ * Returns the family id of an opcode using the two-level paged table
+ */
+function lut_family( _opcode ) {
+    return LUT.sections.PAGE[ ( LUT.sections.PIDX[ _opcode >> LUT.page_shift ] << LUT.page_shift ) | ( _opcode & LUT.page_mask ) ];
+}
+
+/**
+ * LUT.sections.XTAB holds a secondary table for each 68020 family that is decoded from its
+ * extension word, laid out as EXTENSION_FIELDS in genlut.py says, and LUT.sections.XDSC says
+ * where each family's table starts and which bits of the extension word index it.
+ */
+var XDSC_STRIDE        = 12; // EXTENSION_STRIDE
+var XTAB_REG_SHIFT     =  0; // MASK4B, 8-15 are A0-A7
+var XTAB_REG2_SHIFT    =  4; // MASK4B
+var XTAB_REG3_SHIFT    =  8; // MASK4B
+var XTAB_SIGNED_SHIFT  = 12; // MASK1B
+var XTAB_SIZE_SHIFT    = 13; // MASK1B
+var XTAB_DR_SHIFT      = 14; // MASK1B
+var XTAB_DO_SHIFT      = 15; // MASK1B
+var XTAB_DW_SHIFT      = 16; // MASK1B
+
+/**
+ * Returns the secondary table entry for a family's extension word, or -1 if the family has no
+ * table or the extension word isn't valid for it
+ */
+function lut_extension( _family, _extension ) {
+    var xdsc   = LUT.sections.XDSC;
+    var base   = _family * XDSC_STRIDE;
+    var offset = xdsc[ base ];
+
+    if( offset === 0xFFFF || ( _extension & xdsc[ base + 1 ] ) !== xdsc[ base + 2 ] ) {
+        return -1;
+    }
+
+    var index = 0;
+    for( var i = 0; i < xdsc[ base + 3 ]; ++i ) {
+        var shift = xdsc[ base + 4 + 2*i ];
+        var width = xdsc[ base + 5 + 2*i ];
+        index = ( index << width ) | ( ( _extension >> shift ) & ( ( 1 << width ) - 1 ) );
+    }
+
+    return LUT.sections.XTAB[ offset + index ];
+}
+
+/**
+ * Returns whether one of the 16 conditions (the cond field of Bcc, DBcc, Scc and TRAPcc)
+ * holds for the current CCR
+ */
+function lut_condition( _condition ) {
+    return ( LUT.sections.CMSK[ CCR[0] & 0x1F ] >> _condition ) & 1;
+}
+
+/**
+ * Returns the registers (0-7 D0-D7, 8-15 A0-A7) that a MOVEM register list mask names, in
+ * the order they are transferred
+ */
+function lut_movem( _mask, _predecrement ) {
+    var start = LUT.sections.MVOF[ _mask ];
+    var list  = _predecrement ? LUT.sections.MVRP : LUT.sections.MVRN;
+
+    return list.subarray( start, start + LUT.sections.MVCN[ _mask ] );
+}
+
+function load_lut( _url, _callback ) {
+    fetch( _url )
+        .then( function( _response ) {
+            if( !_response.ok ) {
+                throw new Error( _response.status + " " + _response.statusText );
+            }
+            return _response.arrayBuffer();
+        } )
+        .then( function( _buffer ) {
+            _callback( null, parse_lut( _buffer ) );
+        } )
+        .catch( function( _error ) {
+            _callback( _error, null );
+        } );
+}
+
 var stop_execution = false;
 
 var fetch16 = new Uint16Array( 1 );
@@ -285,6 +453,20 @@ var fetch4;
 
 window.onload = function() {
 
+    load_lut( LUT_URL, function( _error, _lut ) {
+        if( _error ) {
+            console.error( "Couldn't load the opcode LUT from %s : %s", LUT_URL, _error );
+        }
+        else {
+            LUT = _lut;
+        }
+
+        run();
+    } );
+}
+
+function run() {
+
     // main emulation loop
     while( !stop_execution ) {
 
@@ -15,9 +15,22 @@
 #  You should have received a copy of the GNU General Public License
 #  along with AEJS.  If not, see <http://www.gnu.org/licenses/>.
 
-from copy import deepcopy
+from array import array
+import argparse
+import bisect
+import hashlib
+import json
+import multiprocessing
+import os
+import random
+import struct
 import sys
 
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
 # Generate a LUT for all 68k opcodes
 
 # Yes, this is in Python.  Yes, AEJS is a JavaScript project.
@@ -1551,78 +1564,2679 @@ OPCODES = {
 #           We will figure out which one it actually is during the 
 #           execute step.  The same goes for any opcode names with a /
 #           in them.
+#
+#           Except that most of them can be told apart from the first
+#           word after all, by a direction bit, a condition or an opmode.
+#           Those are split into separate families below, according to
+#           SPLITS, so that the execute step doesn't have to.  The ones
+#           that really do depend on the extension word are listed in
+#           EXTENSION_VARIANTS instead, which gives each of them a small
+#           secondary table keyed on the extension word bit that decides.
+
+# combined family : ( the slot that decides, [ ( variant, [ alternatives for that slot ] ), ... ] )
+SPLITS = {
+    "BRA/BSR/Bcc"   : ( "BRA/BSR/Bcc_CONDITION", [#{{{
+                        ( "BRA", [ [0,0,0,0] ] ),
+                        ( "BSR", [ [0,0,0,1] ] ),
+                        ( "Bcc", [ [0,0,1,0],
+                                   [0,0,1,1],
+                                   [0,1,0,0],
+                                   [0,1,0,1],
+                                   [0,1,1,0],
+                                   [0,1,1,1],
+                                   [1,0,0,0],
+                                   [1,0,0,1],
+                                   [1,0,1,0],
+                                   [1,0,1,1],
+                                   [1,1,0,0],
+                                   [1,1,0,1],
+                                   [1,1,1,0],
+                                   [1,1,1,1], ] ), ] ),#}}}
+    "EXT/EXTB"      : ( "EXT/EXTB_OPMODE", [#{{{
+                        ( "EXT",  [ [0,1,0], [0,1,1] ] ),
+                        ( "EXTB", [ [1,1,1] ] ), ] ),#}}}
+    "ASL/ASR"       : ( "ASL/ASR_dr",   [ ( "ASR",  [ [0] ] ), ( "ASL",  [ [1] ] ) ] ),
+    "LSL/LSR"       : ( "LSL/LSR_dr",   [ ( "LSR",  [ [0] ] ), ( "LSL",  [ [1] ] ) ] ),
+    "ROXL/ROXR"     : ( "ROXL/ROXR_dr", [ ( "ROXR", [ [0] ] ), ( "ROXL", [ [1] ] ) ] ),
+    "ROL/ROR"       : ( "ROL/ROR_dr",   [ ( "ROR",  [ [0] ] ), ( "ROL",  [ [1] ] ) ] ),
+}
+
+def split_families():#{{{
+    """Replaces each family in SPLITS with its variants, in the same place in OPCODES"""
+    global OPCODES
+
+    opcodes = {}
+    for name in OPCODES:
+        if name not in SPLITS:
+            opcodes[ name ] = OPCODES[ name ]
+            continue
+
+        # each variant gets its own copy of the deciding slot, holding just
+        # its own alternatives, e.g. BRA/BSR/Bcc_CONDITION -> BRA_CONDITION
+        slot, variants = SPLITS[ name ]
+        for variant, alternatives in variants:
+            variant_slot = variant + slot[ len( name ): ]
+            PATTERNS[ variant_slot ] = alternatives
+            opcodes[ variant ] = [ variant_slot if b == slot else b for b in OPCODES[ name ] ]
+
+    OPCODES = opcodes
+#}}}
+
+split_families()
+
+# Which condition code flags each opcode family reads and writes, as
+# ( reads, writes ).  "cc" means whichever flags the instruction's condition
+# tests.  Flags that the PRM calls undefined count as written, since whatever
+# was there before is gone.  Every family in OPCODES needs an entry here.
+#
+# Taking an exception pushes SR, so the instructions that always trap read
+# every flag.  The ones that only sometimes trap are in MAY_TRAP instead.
+CCR_EFFECTS = {
+    "ORI to CCR"    : ( "XNZVC", "XNZVC" ),#{{{
+    "ORI to SR"     : ( "XNZVC", "XNZVC" ),
+    "ORI"           : ( "",      "NZVC"  ),
+    "ANDI to CCR"   : ( "XNZVC", "XNZVC" ),
+    "ANDI to SR"    : ( "XNZVC", "XNZVC" ),
+    "ANDI"          : ( "",      "NZVC"  ),
+    "SUBI"          : ( "",      "XNZVC" ),
+    "RTM"           : ( "",      "XNZVC" ),
+    "CALLM"         : ( "",      ""      ),
+    "ADDI"          : ( "",      "XNZVC" ),
+    "CMP2/CHK2"     : ( "",      "NZVC"  ),
+    "EORI_to_CCR"   : ( "XNZVC", "XNZVC" ),
+    "EORI_to_SR"    : ( "XNZVC", "XNZVC" ),
+    "EORI"          : ( "",      "NZVC"  ),
+    "CMPI"          : ( "",      "NZVC"  ),
+    "BTST_DYNAMIC"  : ( "",      "Z"     ),
+    "BTST_STATIC"   : ( "",      "Z"     ),
+    "BCHG_STATIC"   : ( "",      "Z"     ),
+    "BCHG_DYNAMIC"  : ( "",      "Z"     ),
+    "BCLR"          : ( "",      "Z"     ),
+    "BSET_STATIC"   : ( "",      "Z"     ),
+    "BSET_DYNAMIC"  : ( "",      "Z"     ),
+    "MOVES"         : ( "",      ""      ),
+    "CAS"           : ( "",      "NZVC"  ),
+    "CAS2"          : ( "",      "NZVC"  ),
+    "MOVEP"         : ( "",      ""      ),
+    "MOVEA"         : ( "",      ""      ),
+    "MOVE"          : ( "",      "NZVC"  ),
+    "MOVE_from_SR"  : ( "XNZVC", ""      ),
+    "MOVE_from_CCR" : ( "XNZVC", ""      ),
+    "NEGX"          : ( "XZ",    "XNZVC" ),
+    "CLR"           : ( "",      "NZVC"  ),
+    "MOVE_to_CCR"   : ( "",      "XNZVC" ),
+    "NEG"           : ( "",      "XNZVC" ),
+    "NOT"           : ( "",      "NZVC"  ),
+    "MOVE_to_SR"    : ( "",      "XNZVC" ),
+    "EXT"           : ( "",      "NZVC"  ),
+    "EXTB"          : ( "",      "NZVC"  ),
+    "LINK_LONG"     : ( "",      ""      ),
+    "LINK_WORD"     : ( "",      ""      ),
+    "NBCD"          : ( "XZ",    "XNZVC" ),
+    "SWAP"          : ( "",      "NZVC"  ),
+    "BKPT"          : ( "XNZVC", ""      ),
+    "PEA"           : ( "",      ""      ),
+    "BGND"          : ( "",      ""      ),
+    "ILLEGAL"       : ( "XNZVC", ""      ),
+    "TAS"           : ( "",      "NZVC"  ),
+    "TST"           : ( "",      "NZVC"  ),
+    "MULU_WORD"     : ( "",      "NZVC"  ),
+    "MUL_LONG"      : ( "",      "NZVC"  ),
+    "MULS_WORD"     : ( "",      "NZVC"  ),
+    "DIVS_WORD"     : ( "",      "NZVC"  ),
+    "DIVU_WORD"     : ( "",      "NZVC"  ),
+    "DIV_LONG"      : ( "",      "NZVC"  ),
+    "TRAP"          : ( "XNZVC", ""      ),
+    "UNLK"          : ( "",      ""      ),
+    "MOVE_USP"      : ( "",      ""      ),
+    "RESET"         : ( "",      ""      ),
+    "NOP"           : ( "",      ""      ),
+    "STOP"          : ( "",      "XNZVC" ),
+    "RTE"           : ( "",      "XNZVC" ),
+    "RTD"           : ( "",      ""      ),
+    "RTS"           : ( "",      ""      ),
+    "TRAPV"         : ( "V",     ""      ),
+    "RTR"           : ( "",      "XNZVC" ),
+    "MOVEC"         : ( "",      ""      ),
+    "JSR"           : ( "",      ""      ),
+    "JMP"           : ( "",      ""      ),
+    "MOVEM"         : ( "",      ""      ),
+    "LEA"           : ( "",      ""      ),
+    "CHK"           : ( "",      "NZVC"  ),
+    "ADDQ"          : ( "",      "XNZVC" ), # but not when the destination is An
+    "SUBQ"          : ( "",      "XNZVC" ), # but not when the destination is An
+    "DBcc"          : ( "cc",    ""      ),
+    "TRAPcc"        : ( "cc",    ""      ),
+    "Scc"           : ( "cc",    ""      ),
+    "BRA"           : ( "",      ""      ),
+    "BSR"           : ( "",      ""      ),
+    "Bcc"           : ( "cc",    ""      ),
+    "MOVEQ"         : ( "",      "NZVC"  ),
+    "SBCD"          : ( "XZ",    "XNZVC" ),
+    "PACK"          : ( "",      ""      ),
+    "UNPK"          : ( "",      ""      ),
+    "OR"            : ( "",      "NZVC"  ),
+    "SUBX"          : ( "XZ",    "XNZVC" ),
+    "SUB"           : ( "",      "XNZVC" ),
+    "SUBA"          : ( "",      ""      ),
+    "CMPM"          : ( "",      "NZVC"  ),
+    "CMP"           : ( "",      "NZVC"  ),
+    "CMPA"          : ( "",      "NZVC"  ),
+    "EOR"           : ( "",      "NZVC"  ),
+    "ABCD"          : ( "XZ",    "XNZVC" ),
+    "EXG"           : ( "",      ""      ),
+    "AND"           : ( "",      "NZVC"  ),
+    "ADDX"          : ( "XZ",    "XNZVC" ),
+    "ADDA"          : ( "",      ""      ),
+    "ADD"           : ( "",      "XNZVC" ),
+    "ASL"           : ( "",      "XNZVC" ), # but not X when the count is in a register
+    "ASR"           : ( "",      "XNZVC" ), # but not X when the count is in a register
+    "LSL"           : ( "",      "XNZVC" ), # but not X when the count is in a register
+    "LSR"           : ( "",      "XNZVC" ), # but not X when the count is in a register
+    "ROXL"          : ( "X",     "XNZVC" ), # but not X when the count is in a register
+    "ROXR"          : ( "X",     "XNZVC" ), # but not X when the count is in a register
+    "ROL"           : ( "",      "NZVC"  ),
+    "ROR"           : ( "",      "NZVC"  ),
+    "BFTST"         : ( "",      "NZVC"  ),
+    "BFEXTU"        : ( "",      "NZVC"  ),
+    "BFCHG"         : ( "",      "NZVC"  ),
+    "BFEXTS"        : ( "",      "NZVC"  ),
+    "BFCLR"         : ( "",      "NZVC"  ),
+    "BFFFO"         : ( "",      "NZVC"  ),
+    "BFSET"         : ( "",      "NZVC"  ),
+    "BFINS"         : ( "",      "NZVC"  ),
+}#}}}
 
-INSTRUCTIONS = []
-for i in range(2**16):
-    INSTRUCTIONS.append( None )
+#**************************
+#
+# Template compiler
+#
+#**************************
+
+# Rather than recursively splicing pattern alternatives into copies of the
+# bit list, each template is compiled up front into a list of rules:
+#
+#     ( width, mask, value, fields )
+#
+# A 1 in `mask` is a bit fixed by the rule, and its state is held in `value`.
+# A 0 in `mask` is a "don't care" bit, which comes from a pattern whose
+# alternatives cover every combination of those bits (vector3 and friends).
+# `fields` is a tuple of ( slot_name, shift, width ) triples that records
+# which named PATTERNS slot of the template produced which bits.
+#
+# A pattern name that isn't in PATTERNS expands to nothing, so any template
+# alternative that references one produces no opcodes, exactly like the old
+# recursive gen() did.
+
+def merge_terms( _terms ):#{{{
+    """Merges ( width, mask, value ) terms that differ in exactly one fixed bit"""
+    terms  = list( _terms )
+    merged = True
+
+    while merged:
+        merged = False
+        for a in range( len( terms ) ):
+            aw, am, av = terms[a]
+            for b in range( a + 1, len( terms ) ):
+                bw, bm, bv = terms[b]
+                diff = av ^ bv
+                # same width, same fixed bits, and exactly one fixed bit differs
+                if aw == bw and am == bm and diff and diff & ( diff - 1 ) == 0:
+                    terms[a] = ( aw, am & ~diff, av & ~diff )
+                    terms.pop( b )
+                    merged = True
+                    break
+            if merged:
+                break
+
+    return terms
+#}}}
+
+# Lots of PATTERNS entries are identical apart from their name (ORI_EA,
+# ANDI_EA, SUBI_EA, ... and all of their *_ABS_REG lists), and the same ones
+# get referenced over and over.  So each pattern is given a key built from its
+# contents, with any nested pattern names replaced by their own keys, and
+# every distinct key is only ever expanded once.
+
+PATTERN_KEYS = {} # pattern name -> content key
+EXPANSIONS   = {} # content key  -> tuple of ( width, mask, value ) terms
+
+def pattern_key( _name ):#{{{
+    """Returns a key for a named pattern that depends only on its contents"""
+    if _name not in PATTERN_KEYS:
+        if _name not in PATTERNS:
+            key = None # unknown patterns expand to nothing
+        else:
+            key = tuple( tuple( b if b in [0,1] else pattern_key( b ) for b in alternative )
+                         for alternative in PATTERNS[ _name ] )
+
+        PATTERN_KEYS[ _name ] = key
+
+    return PATTERN_KEYS[ _name ]
+#}}}
+
+def flatten( _name ):#{{{
+    """Expands a named pattern into a tuple of ( width, mask, value ) terms"""
+    key = pattern_key( _name )
+
+    if key not in EXPANSIONS:
+        terms = []
+        if key != None:
+            for alternative in PATTERNS[ _name ]:
+                for width, mask, value, fields in compile_bits( alternative ):
+                    terms.append( ( width, mask, value ) )
+
+        EXPANSIONS[ key ] = tuple( merge_terms( terms ) )
+
+    return EXPANSIONS[ key ]
+#}}}
+
+def compile_bits( _bits ):#{{{
+    """Compiles a list of bits and pattern names into ( width, mask, value, fields ) rules"""
+    rules = [ ( 0, 0, 0, () ) ]
 
-def isstatic( _bits ):
-    """Returns true if the bits are all ones and zeroes (no patterns)"""
     for b in _bits:
-        if b not in [0,1]:
-            return False
-    return True
+        if b in [0,1]:
+            terms = [ ( 1, 1, b ) ]
+        else:
+            terms = flatten( b )
+
+        rules = [ ( width + tw,
+                    ( mask  << tw ) | tm,
+                    ( value << tw ) | tv,
+                    fields + ( ( b, width, tw ), ) if b not in [0,1] else fields )
+                  for width, mask, value, fields in rules
+                  for tw, tm, tv in terms ]
+
+    # fields were recorded as ( slot, offset from the msb, width ); now that
+    # the total width is known, turn the offsets into shifts from the lsb.
+    return [ ( width, mask, value,
+               tuple( ( slot, width - offset - w, w ) for slot, offset, w in fields ) )
+             for width, mask, value, fields in rules ]
+#}}}
 
-def gen( _bits, _name ):
+#**************************
+#
+# Family ids
+#
+#**************************
+
+# Rather than a list of 65536 references to name strings, INSTRUCTIONS holds
+# one small integer id per opcode, and FAMILIES is the table that those ids
+# index into.  Id 0 is reserved for unassigned opcodes.
+#
+# Ids are handed out in order of major opcode (the top four bits, see
+# MAJOR_OPCODES in ae.js), so the families that share a major opcode have
+# neighbouring ids.
+
+def major_opcode( _bits ):#{{{
+    """Returns the lowest major opcode nibble an OPCODES template can produce, or 16 if unknown"""
+    rules = compile_bits( _bits )
+    if rules:
+        return min( value >> 12 for width, mask, value, fields in rules )
+
+    # A template that doesn't produce any opcodes yet (because of a missing
+    # pattern) can still be placed by its leading static bits.
+    if len( _bits ) >= 4 and all( b in [0,1] for b in _bits[:4] ):
+        return int( "".join( "%d" % b for b in _bits[:4] ), 2 )
+
+    return 16
+#}}}
+
+def intern_families():#{{{
+    """Returns the FAMILIES metadata table, ordered by major opcode"""
+    ops = [ op for op in OPCODES if op != None ]
+    ops.sort( key=lambda op: major_opcode( OPCODES[op] ) ) # sort() is stable, so OPCODES order breaks ties
 
-    if isstatic( _bits ):
-        # Okay, if all the bits are static (no more variables), that is the recursion termination
-        # condition.
+    families = [ { "name" : None, "major" : None } ]
+    for op in ops:
+        families.append( { "name" : op, "major" : major_opcode( OPCODES[op] ) } )
 
-        # Let's put the bits into a nice-to-look-at string, and calculate the base-10 value
+    return families
+#}}}
+
+FAMILIES   = intern_families()
+FAMILY_IDS = dict( ( family["name"], i ) for i, family in enumerate( FAMILIES ) if i != 0 )
+
+# "B" (uint8) is plenty until there are more than 255 families
+ID_TYPECODE = "B" if len( FAMILIES ) <= 256 else "H"
+
+INSTRUCTIONS = array( ID_TYPECODE, bytes( 2**16 * array( ID_TYPECODE ).itemsize ) )
 
-        bit_string = "".join( [ "%d" % bit for bit in _bits ] )
-        bit_value  = int( bit_string, 2 )
-        bit_string = bit_string[:8] + " " + bit_string[8:]
+def expand( _rules, _name ):#{{{
+    """Returns an array of every opcode matched by a family's compiled rules"""
+    cells = array( "H" )
+
+    for width, mask, value, fields in _rules:
 
         # There was a lot of manual typing in the OPCODES dict above, so
         # let's do some error checking.
 
-        # Before we do anything with this value, we need to be sure it's the correct
+        # Before we do anything with this rule, we need to be sure it's the correct
         # length, which is two bytes, aka one "word", aka sixteen bits.
         assert  \
-            len( _bits ) == 16, \
-            "The bit pattern for %s has length %d, when 16 is required." % ( _name, len(_bits) )
+            width == 16, \
+            "The bit pattern for %s has length %d, when 16 is required." % ( _name, width )
+
+        # Walk every combination of the don't-care bits.  ( sub - free ) & free
+        # steps to the next subset of `free`, and wraps back around to 0.
+        free = ~mask & 0xFFFF
+        sub  = 0
+        while True:
+            cells.append( value | sub )
+
+            sub = ( sub - free ) & free
+            if sub == 0:
+                break
+
+    return cells
+#}}}
+
+def place( _cells, _name ):#{{{
+    """Writes a family's id into INSTRUCTIONS at each of the given opcodes"""
+    family = FAMILY_IDS[ _name ]
+
+    for bit_value in _cells:
 
         # if there is already a value here, fail with collision message
         assert  \
-            INSTRUCTIONS[ bit_value ] == None, \
+            INSTRUCTIONS[ bit_value ] == 0, \
             "Attempted to add new opcode %s as bit pattern %s, but that pattern already exists for opcode %s."  \
-            % ( _name, bit_string, INSTRUCTIONS[ bit_value ] )
+            % ( _name, "{:08b} {:08b}".format( bit_value >> 8, bit_value & 0xFF ), FAMILIES[ INSTRUCTIONS[ bit_value ] ]["name"] )
+
+        INSTRUCTIONS[ bit_value ] = family
+#}}}
+
+def gen( _bits, _name ):#{{{
+    """Compiles an OPCODES template and fills INSTRUCTIONS with its opcodes"""
+    rules = compile_bits( _bits )
+    place( expand( rules, _name ), _name )
+
+    return rules
+#}}}
+
+#**************************
+#
+# Overlap analysis
+#
+#**************************
+
+# Two mask/value rules share an opcode exactly when they agree on every bit
+# that both of them fix, so overlapping templates can be found by comparing
+# rules, without expanding anything.  The overlap of two rules is itself a
+# rule, with the fixed bits of both, which gives the count and an example.
+
+def find_overlaps():#{{{
+    """Returns ( name_a, name_b, count, example ) for every pair of families whose templates overlap"""
+    families = []
+    for family in FAMILIES[1:]:
+        rules = [ ( mask, value ) for width, mask, value, fields in compile_bits( OPCODES[ family["name"] ] )
+                  if width == 16 ] # bad lengths are caught by expand()
+        families.append( ( family["name"], rules ) )
+
+    overlaps = []
+    for a in range( len( families ) ):
+        name_a, rules_a = families[a]
+
+        # a == b checks a family against itself, for templates that produce
+        # the same opcode twice
+        for b in range( a, len( families ) ):
+            name_b, rules_b = families[b]
+            count   = 0
+            example = None
+
+            for i in range( len( rules_a ) ):
+                mask_a, value_a = rules_a[i]
+
+                for mask_b, value_b in ( rules_b[ i + 1: ] if a == b else rules_b ):
+                    if ( value_a ^ value_b ) & mask_a & mask_b == 0:
+                        count += 1 << ( 16 - bin( mask_a | mask_b ).count( "1" ) )
+                        if example == None or value_a | value_b < example:
+                            example = value_a | value_b
+
+            if count:
+                overlaps.append( ( name_a, name_b, count, example ) )
+
+    return overlaps
+#}}}
+
+def report_overlaps( _overlaps ):#{{{
+    """Writes a line to stderr for each overlap found by find_overlaps()"""
+    for name_a, name_b, count, example in _overlaps:
+        sys.stderr.write( "{:s} overlaps {:s}: {:d} opcodes, e.g. {:08b} {:08b}\n".format(
+            name_a, name_b, count, example >> 8, example & 0xFF ) )
+#}}}
+
+#**************************
+#
+# Unassigned opcodes
+#
+#**************************
+
+# The opcodes that no template produces are the complement of every rule in
+# OPCODES, and that can be worked out on the ( mask, value ) rules directly,
+# without expanding anything: start from one rule that matches everything,
+# and take each family's rules away from it in turn.
+#
+# Taking rule R away from a rule C that it overlaps leaves one rule for each
+# bit that R fixes and C doesn't: C, plus R's values for the bits before
+# that one, plus the opposite of R's value for that bit.  Those rules don't
+# overlap each other, so the result never counts an opcode twice.
+#
+# The 68000 sends every unassigned opcode to one of three exceptions, by its
+# major opcode, so the ranges are tagged with the one they take.
+
+TRAP_CLASSES = [ None, "illegal", "A-line", "F-line" ]
+TRAP_ILLEGAL = 1
+TRAP_LINE_A  = 2
+TRAP_LINE_F  = 3
+
+def subtract_rule( _mask, _value, _rule_mask, _rule_value ):#{{{
+    """Returns the ( mask, value ) rules that match what one rule matches and another doesn't"""
+    if ( _value ^ _rule_value ) & _mask & _rule_mask:
+        return [ ( _mask, _value ) ] # they don't overlap
+
+    result = []
+    mask   = _mask
+    value  = _value
+    for bit in range( 15, -1, -1 ):
+        b = 1 << bit
+        if _rule_mask & b and not _mask & b:
+            result.append( ( mask | b, value | ( ~_rule_value & b ) ) )
+            mask  |= b
+            value |= _rule_value & b
+
+    return result
+#}}}
+
+def unassigned_rules():#{{{
+    """Returns non-overlapping ( mask, value ) rules for every opcode that no family produces"""
+
+    # one starting rule per major opcode keeps the lists that each family's
+    # rules get taken away from short
+    result = [ ( 0xF000, major << 12 ) for major in range( 16 ) ]
+
+    for family in FAMILIES[1:]:
+        for width, rule_mask, rule_value, fields in compile_bits( OPCODES[ family["name"] ] ):
+            if width != 16:
+                continue # bad lengths are caught by expand()
+
+            result = [ rule for mask, value in result
+                       for rule in subtract_rule( mask, value, rule_mask, rule_value ) ]
+
+    return result
+#}}}
+
+def rule_ranges( _mask, _value ):#{{{
+    """Returns the [ start, end ] ranges of opcodes that a ( mask, value ) rule matches"""
+
+    # the don't-care bits below the lowest fixed bit make each range; the
+    # rest of the don't-care bits pick which ranges there are
+    low  = ( _mask & -_mask ) - 1 if _mask else 0xFFFF
+    free = ~_mask & 0xFFFF & ~low
+
+    result = []
+    sub    = 0
+    while True:
+        start = _value | sub
+        result.append( [ start, start | low ] )
+
+        sub = ( sub - free ) & free
+        if sub == 0:
+            break
+
+    return result
+#}}}
+
+def trap_class( _opcode ):#{{{
+    """Returns which of the TRAP_CLASSES an unassigned opcode raises"""
+    major = _opcode >> 12
+
+    if major == 0xA:
+        return TRAP_LINE_A
+    if major == 0xF:
+        return TRAP_LINE_F
+
+    return TRAP_ILLEGAL
+#}}}
+
+def unassigned_ranges():#{{{
+    """Returns the sorted [ start, end, class ] runs of unassigned opcodes, for lookup()"""
+    ranges = sorted( r for mask, value in unassigned_rules() for r in rule_ranges( mask, value ) )
+
+    result = []
+    for start, end in ranges:
+        # rules never cross a major opcode, so neither do the runs
+        if result and result[-1][1] == start - 1 and start & 0xFFF:
+            result[-1][1] = end
+        else:
+            result.append( [ start, end, trap_class( start ) ] )
+
+    return result
+#}}}
+
+def unassigned_listing( _runs ):#{{{
+    """Prints the unassigned runs, and how many opcodes raise each exception"""
+    counts = [ 0 ] * len( TRAP_CLASSES )
+
+    for start, end, trap in _runs:
+        counts[ trap ] += end - start + 1
+        if start == end:
+            print( "0x{:04X}        -> {:s}".format( start, TRAP_CLASSES[ trap ] ) )
+        else:
+            print( "0x{:04X}-0x{:04X} -> {:s}".format( start, end, TRAP_CLASSES[ trap ] ) )
+
+    for trap in range( 1, len( TRAP_CLASSES ) ):
+        print( "{:s}: {:d} opcodes".format( TRAP_CLASSES[ trap ], counts[ trap ] ) )
+#}}}
+
+#**************************
+#
+# NumPy backend
+#
+#**************************
+
+# The numpy backend builds the same table of family ids as gen(), but as a
+# numpy array, with every rule of a family scattered in at once.
+
+ID_DTYPE = "uint8" if ID_TYPECODE == "B" else "uint16"
+
+def rule_indices( _mask, _value ):#{{{
+    """Returns a numpy array of every opcode matched by a mask/value rule"""
+    indices = numpy.array( [ _value ], dtype=numpy.uint32 )
+
+    # double the array for each don't-care bit, once with the bit clear and
+    # once with it set
+    free = ~_mask & 0xFFFF
+    while free:
+        bit     = free & -free
+        indices = numpy.concatenate( ( indices, indices | bit ) )
+        free   &= free - 1
+
+    return indices
+#}}}
+
+def gen_numpy( _bits, _name, _table, _id ):#{{{
+    """Compiles an OPCODES template and scatters its family id into _table"""
+
+    rules = compile_bits( _bits )
+    if not rules:
+        return rules
+
+    for width, mask, value, fields in rules:
+        assert  \
+            width == 16, \
+            "The bit pattern for %s has length %d, when 16 is required." % ( _name, width )
+
+    indices = numpy.concatenate( [ rule_indices( mask, value ) for width, mask, value, fields in rules ] )
+
+    # Collisions with other families, and with this family's own rules, are
+    # all gathered up at once so that every bad pattern gets reported.
+    counts    = numpy.bincount( indices, minlength=2**16 )
+    collision = numpy.nonzero( ( counts > 1 ) | ( ( counts > 0 ) & ( _table != 0 ) ) )[0]
+
+    assert  \
+        len( collision ) == 0, \
+        "Attempted to add new opcode %s, but these bit patterns already exist:\n%s"  \
+        % ( _name, "\n".join( "    {:08b} {:08b} for opcode {:s}".format(
+                i >> 8, i & 0xFF, FAMILIES[ _table[i] ]["name"] if _table[i] else _name ) for i in collision ) )
+
+    _table[ indices ] = _id
+
+    return rules
+#}}}
+
+def gen_numpy_table():#{{{
+    """Builds a numpy table of family ids for every opcode"""
+    table = numpy.zeros( 2**16, dtype=ID_DTYPE )
+
+    for family in FAMILIES[1:]:
+        gen_numpy( OPCODES[ family["name"] ], family["name"], table, FAMILY_IDS[ family["name"] ] )
+
+    return table
+#}}}
+
+#**************************
+#
+# Incremental cache
+#
+#**************************
+
+# With --cache DIR, the expanded opcodes of each family are saved to DIR under
+# a fingerprint of its template and every pattern it (transitively) refers
+# to, along with the finished table.  On the next run only the families whose
+# fingerprint changed are expanded again and merged into the old table, so
+# fixing a single *_EA list doesn't mean redoing all 65536 entries.
+#
+# Bump CACHE_VERSION whenever a change to the compiler would change what an
+# unchanged template expands to.
+
+CACHE_VERSION = 1
+
+def fingerprint( _name ):#{{{
+    """Returns a hash of an OPCODES template and all the patterns it refers to"""
+    template = tuple( b if b in [0,1] else pattern_key( b ) for b in OPCODES[ _name ] )
+    return hashlib.sha1( repr( ( CACHE_VERSION, template ) ).encode( "utf-8" ) ).hexdigest()
+#}}}
+
+def load_cache( _cache_dir ):#{{{
+    """Loads the previous table into INSTRUCTIONS and returns the old fingerprints, or {} if unusable"""
+    try:
+        with open( os.path.join( _cache_dir, "index.json" ) ) as f:
+            index = json.load( f )
+
+        table = array( ID_TYPECODE )
+        with open( os.path.join( _cache_dir, "table.bin" ), "rb" ) as f:
+            table.frombytes( f.read() )
+
+    except ( IOError, ValueError ):
+        return {}
+
+    # The ids (and so the whole table) are only any good if the same
+    # families were numbered in the same order.
+    if index.get( "version" ) != CACHE_VERSION                              \
+            or index.get( "families" ) != [ family["name"] for family in FAMILIES ] \
+            or len( table ) != 2**16:
+        return {}
+
+    INSTRUCTIONS[:] = table
+    return index[ "fingerprints" ]
+#}}}
+
+def gen_cached( _cache_dir ):#{{{
+    """Fills INSTRUCTIONS, re-expanding only the families that changed since the last run"""
+    if not os.path.isdir( _cache_dir ):
+        os.makedirs( _cache_dir )
+
+    old_fingerprints = load_cache( _cache_dir )
+    fingerprints     = dict( ( family["name"], fingerprint( family["name"] ) ) for family in FAMILIES[1:] )
+    changed          = [ op for op in fingerprints if old_fingerprints.get( op ) != fingerprints[ op ] ]
+
+    # clear out whatever the changed families used to hold
+    if old_fingerprints:
+        stale = set( FAMILY_IDS[ op ] for op in changed )
+        for i in range( 2**16 ):
+            if INSTRUCTIONS[i] in stale:
+                INSTRUCTIONS[i] = 0
+
+    # Only the changed families get placed, so only their opcodes get checked
+    # for collisions.
+    for op in changed:
+        path  = os.path.join( _cache_dir, fingerprints[ op ] + ".cells" )
+        cells = array( "H" )
+
+        if os.path.exists( path ):
+            with open( path, "rb" ) as f:
+                cells.frombytes( f.read() )
+        else:
+            cells = expand( compile_bits( OPCODES[op] ), op )
+            with open( path, "wb" ) as f:
+                f.write( cells.tobytes() )
+
+        place( cells, op )
+
+    with open( os.path.join( _cache_dir, "table.bin" ), "wb" ) as f:
+        f.write( INSTRUCTIONS.tobytes() )
+
+    with open( os.path.join( _cache_dir, "index.json" ), "w" ) as f:
+        json.dump( { "version"      : CACHE_VERSION,
+                     "families"     : [ family["name"] for family in FAMILIES ],
+                     "fingerprints" : fingerprints }, f, indent=1 )
+
+    return changed
+#}}}
+
+#**************************
+#
+# Parallel expansion
+#
+#**************************
+
+# With --jobs N, the families are expanded in a pool of N processes.  Each
+# worker sends back a compact ( id, cells ) pair, and the merge step does the
+# collision checking for all of them, reporting every clash it finds instead
+# of stopping at the first one.
+
+def expand_family( _name ):#{{{
+    """Expands one family in a worker process and returns ( id, cells )"""
+    return FAMILY_IDS[ _name ], expand( compile_bits( OPCODES[ _name ] ), _name )
+#}}}
+
+def merge( _results ):#{{{
+    """Merges ( id, cells ) results into INSTRUCTIONS, asserting on every collision"""
+    collisions = []
+
+    for family, cells in _results:
+        for bit_value in cells:
+            if INSTRUCTIONS[ bit_value ] != 0:
+                collisions.append( ( bit_value, family, INSTRUCTIONS[ bit_value ] ) )
+            else:
+                INSTRUCTIONS[ bit_value ] = family
+
+    assert  \
+        len( collisions ) == 0, \
+        "Found %d colliding bit patterns:\n%s"  \
+        % ( len( collisions ), "\n".join(
+            "    {:08b} {:08b} for opcode {:s} already belongs to opcode {:s}".format(
+                bit_value >> 8, bit_value & 0xFF, FAMILIES[ family ]["name"], FAMILIES[ existing ]["name"] )
+            for bit_value, family, existing in collisions ) )
+#}}}
+
+def gen_parallel( _jobs ):#{{{
+    """Fills INSTRUCTIONS by expanding every family in a pool of _jobs processes"""
+    pool = multiprocessing.Pool( _jobs )
+    try:
+        # map() keeps the results in FAMILIES order, so the merge (and its
+        # collision report) comes out the same no matter which worker finishes first
+        results = pool.map( expand_family, [ family["name"] for family in FAMILIES[1:] ] )
+    finally:
+        pool.close()
+        pool.join()
+
+    merge( results )
+#}}}
+
+#**************************
+#
+# Range compression
+#
+#**************************
+
+# Most families fill long runs of neighbouring opcodes (MOVEQ, Bcc and the
+# MOVEs cover thousands each), so the table compresses nicely into a sorted
+# list of [ start, end, id ] runs, with `end` inclusive and unassigned opcodes
+# left out.  lookup() finds an opcode's run with a binary search.
+
+def runs( _table ):#{{{
+    """Returns the sorted [ start, end, id ] runs of assigned opcodes in a table of family ids"""
+    result = []
+
+    for i in range( len( _table ) ):
+        family = _table[i]
+        if family == 0:
+            continue
+
+        if result and result[-1][1] == i - 1 and result[-1][2] == family:
+            result[-1][1] = i
+        else:
+            result.append( [ i, i, family ] )
+
+    return result
+#}}}
+
+def lookup( _runs, _opcode ):#{{{
+    """Returns the family id of an opcode from a list of runs, or 0 if it is unassigned"""
 
-        #print( "\t%s" % bit_string )
+    # [ _opcode, 2**16 ] sorts after every run that starts at or before _opcode
+    i = bisect.bisect_right( _runs, [ _opcode, 2**16 ] ) - 1
 
-        INSTRUCTIONS[ bit_value ] = _name
-        
-    i = 0
+    if i >= 0 and _runs[i][1] >= _opcode:
+        return _runs[i][2]
 
-    while i in range( len( _bits ) ): # strange loop
+    return 0
+#}}}
 
-        b = _bits[i]
-        pattern_length = 1
+def listing( _runs ):#{{{
+    """Prints the runs as a grouped, human readable listing"""
+    for start, end, family in _runs:
+        if start == end:
+            print( "0x{:04X}        -> {:s}".format( start, FAMILIES[ family ]["name"] ) )
+        else:
+            print( "0x{:04X}-0x{:04X} -> {:s}".format( start, end, FAMILIES[ family ]["name"] ) )
+#}}}
 
-        if b in PATTERNS:
-            pat            = PATTERNS[b]
-            pattern_length = len( [ bit for bit in pat if bit in [0,1] ] )
+#**************************
+#
+# Paged table
+#
+#**************************
 
-            for p in pat:
-                bits_copy = deepcopy( _bits )
-                bits_copy.pop(i)
-                bits_copy[i:i] = p
-                gen( bits_copy, _name )
+# ae.js already splits decoding up by major opcode, so the table can be split
+# the same way: a first level index on the top 4 (or 8) bits of the opcode,
+# pointing at second level pages that hold the ids for the rest.  Whole
+# regions of the opcode space have identical pages (the A-line and F-line
+# ranges are all unassigned, MOVEQ's pages are all MOVEQ, ...) and each of
+# those is only stored once, which keeps the decoder's working set small.
 
-            return # return, since a pattern has been found and fully populated
+def pages( _table, _bits=8 ):#{{{
+    """Splits a table into ( index, pages ) on its top _bits bits, keeping one copy of identical pages"""
+    size   = 2**16 >> _bits
+    index  = array( "H" )
+    data   = array( _table.typecode )
+    unique = {}
 
-        i += pattern_length
+    for p in range( 2**_bits ):
+        page = _table[ p * size : ( p + 1 ) * size ]
+        key  = page.tobytes()
 
-    return _bits
+        if key not in unique:
+            unique[ key ] = len( unique )
+            data.extend( page )
 
-for op in OPCODES:
-    if op != None:
-        gen( OPCODES[op], op )
+        index.append( unique[ key ] )
+
+    return index, data
+#}}}
+
+def page_lookup( _index, _pages, _opcode ):#{{{
+    """Returns the family id of an opcode from the output of pages()"""
+    shift = 16 - ( len( _index ).bit_length() - 1 )
+
+    return _pages[ ( _index[ _opcode >> shift ] << shift ) | ( _opcode & ( ( 1 << shift ) - 1 ) ) ]
+#}}}
+
+def report_pages( _table, _index, _pages ):#{{{
+    """Writes the size of a paged table, next to the flat table, to stderr"""
+    flat  = len( _table ) * _table.itemsize
+    paged = len( _index ) * _index.itemsize + len( _pages ) * _pages.itemsize
+
+    sys.stderr.write( "paged table: %d unique pages of %d, %d bytes against %d flat (%d bytes saved)\n"
+            % ( len( _pages ) // ( len( _table ) // len( _index ) ), len( _index ), paged, flat, flat - paged ) )
+#}}}
+
+#**************************
+#
+# Operand fields
+#
+#**************************
+
+# The compiled rules remember which named slot of a template produced which
+# bits, so the operand fields of every opcode can be decoded here once,
+# instead of with masks and shifts on every fetch in ae.js.  Each opcode gets
+# a 32 bit word laid out as OPERAND_FIELDS says:
+#
+#     bits  0- 7  family id
+#     bits  8- 9  size: 0 byte, 1 word, 2 long, 3 unsized
+#     bits 10-12  effective address mode            \  or, for families with no
+#     bits 13-15  effective address register        |  effective address, 8 bits
+#     bits 16-18  destination mode (MOVE)           |  of data in bits 10-17
+#     bits 19-21  destination register (MOVE)       /  (MOVEQ, Bcc, TRAP, ...)
+#     bits 22-24  register in bits 11-9 of the opcode (Dn, An, Rx, ADDQ data, ...)
+#     bits 25-27  register in bits 2-0 of the opcode, when it isn't part of an EA
+#     bits 28-31  opmode, direction or R/M bit, or condition (see OPMODE_ENCODINGS)
+#
+# How each slot is read is decided from its name by slot_field().  Sizes are
+# encoded differently from one instruction to the next, so SIZE_ENCODINGS
+# maps the raw bits of a slot to the size codes above, for every slot that
+# doesn't use the plain 00/01/10 encoding of *_S or the ADD-style opmodes.
+
+OPERAND_FIELDS = { #{{{
+    # field       ( shift, width )
+    "id"        : (  0, 8 ),
+    "size"      : (  8, 2 ),
+    "ea_mode"   : ( 10, 3 ),
+    "ea_reg"    : ( 13, 3 ),
+    "dst_mode"  : ( 16, 3 ),
+    "dst_reg"   : ( 19, 3 ),
+    "data"      : ( 10, 8 ),
+    "reg"       : ( 22, 3 ),
+    "reg2"      : ( 25, 3 ),
+    "opmode"    : ( 28, 4 ),
+    "cond"      : ( 28, 4 ),
+}#}}}
+
+SIZE_UNSIZED = 3
+
+SIZE_ENCODINGS = { #{{{
+    "S"               : { 0:0, 1:1, 2:2 }, # *_S
+    "OPMODE"          : { 0:0, 1:1, 2:2, 3:1, 4:0, 5:1, 6:2, 7:2 }, # *_OPMODE, *_OPMODE_EA (ADD, SUB, CMP, ...)
+
+    "MOVE_S"          : { 1:0, 3:1, 2:2 },
+    "MOVEA_S"         : { 3:1, 2:2 },
+    "CHK_S"           : { 3:1, 2:2 },
+    "CAS_S"           : { 1:0, 2:1, 3:2 },
+    "CAS2_S"          : { 2:1, 3:2 },
+    "MOVEM_S"         : { 0:1, 1:2 },
+    "TRAPcc_OPCODE"   : { 2:1, 3:2, 4:SIZE_UNSIZED },
+    "EXT_OPMODE"      : { 2:1, 3:2 },
+    "EXTB_OPMODE"     : { 7:2 },
+    "MOVEP_OPMODE"    : { 4:1, 5:2, 6:1, 7:2 },
+    "EXG_OPMODE"      : { 8:2, 9:2, 17:2 },
+}#}}}
+
+# Opmode slots that are too wide for the opmode field, mapped to small codes
+OPMODE_ENCODINGS = { #{{{
+    "EXG_OPMODE"      : { 8:0, 9:1, 17:2 }, # Dx,Dy  Ax,Ay  Dx,Ay
+}#}}}
+
+def slot_field( _slot, _shift, _width ):#{{{
+    """Returns how a named template slot is packed: "ea", "dst_ea", "opmode_ea", "size", "opmode", "cond", "data", "reg", "reg2" or None"""
+    if _slot.endswith( "_OPMODE_EA" ):
+        return "opmode_ea"
+    if _slot.endswith( "_DESTINATION" ):
+        return "dst_ea"
+    if _slot.endswith( "_EA" ) or _slot.endswith( "_SOURCE" ):
+        return "ea"
+    if _slot.endswith( "_CONDITION" ):
+        return "cond"
+    if _slot.endswith( "_OPMODE" ) or _slot.endswith( "_dr" ) or _slot.endswith( "_RM" ) or _slot.endswith( "_i/r" ) or _slot.endswith( "_b" ):
+        return "opmode"
+    if _slot.endswith( "_S" ) or _slot in SIZE_ENCODINGS:
+        return "size"
+    if _slot.endswith( "_VECTOR" ) or _slot.endswith( "_DISPLACEMENT" ) or _width > 3:
+        return "data"
+    if _shift == 9:
+        return "reg"
+    if _shift == 0:
+        return "reg2"
+    return None
+#}}}
+
+def pack_field( _word, _field, _value ):#{{{
+    """Returns an operand word with one of its OPERAND_FIELDS set"""
+    shift, width = OPERAND_FIELDS[ _field ]
+    assert _value >> width == 0, "%d doesn't fit in the %d bit %s field of an operand word." % ( _value, width, _field )
+
+    mask = ( ( 1 << width ) - 1 ) << shift
+    return ( _word & ~mask ) | ( _value << shift )
+#}}}
+
+def operand_word( _opcode, _family, _fields ):#{{{
+    """Packs the family id and decoded operand fields of one opcode"""
+    word = pack_field( _family, "size", SIZE_UNSIZED )
+
+    for slot, shift, width in _fields:
+        raw   = ( _opcode >> shift ) & ( ( 1 << width ) - 1 )
+        field = slot_field( slot, shift, width )
+
+        if field == "opmode_ea": # three bits of opmode, then an EA
+            word = pack_field( word, "opmode", raw >> 6 )
+            word = pack_field( word, "size", SIZE_ENCODINGS[ "OPMODE" ][ raw >> 6 ] )
+            field, raw = "ea", raw & 0x3F
+
+        if field == "ea":
+            word = pack_field( word, "ea_mode", raw >> 3 )
+            word = pack_field( word, "ea_reg",  raw & 7 )
+        elif field == "dst_ea": # MOVE puts the register before the mode
+            word = pack_field( word, "dst_reg",  raw >> 3 )
+            word = pack_field( word, "dst_mode", raw & 7 )
+        elif field == "size":
+            word = pack_field( word, "size", SIZE_ENCODINGS.get( slot, SIZE_ENCODINGS[ "S" ] )[ raw ] )
+        elif field == "opmode":
+            word = pack_field( word, "opmode", OPMODE_ENCODINGS[ slot ][ raw ] if slot in OPMODE_ENCODINGS else raw )
+            if slot.endswith( "_OPMODE" ):
+                word = pack_field( word, "size", SIZE_ENCODINGS.get( slot, SIZE_ENCODINGS[ "OPMODE" ] )[ raw ] )
+        elif field != None:
+            word = pack_field( word, field, raw )
+
+    return word
+#}}}
+
+def family_fields():#{{{
+    """Returns the ( slot, shift, width ) fields of each family, indexed by id"""
+
+    # every rule of a template has the same slots, so any rule will do
+    fields = [ () ]
+    for family in FAMILIES[1:]:
+        rules = compile_bits( OPCODES[ family["name"] ] )
+        fields.append( rules[0][3] if rules else () )
+
+    return fields
+#}}}
+
+def ea_slots():#{{{
+    """Returns ( has_ea, has_dst ) lists saying which families, by id, have an EA and a destination EA"""
+    has_ea  = []
+    has_dst = []
+
+    for fields in family_fields():
+        kinds = [ slot_field( slot, shift, width ) for slot, shift, width in fields ]
+        has_ea.append( "ea" in kinds or "opmode_ea" in kinds )
+        has_dst.append( "dst_ea" in kinds )
+
+    return has_ea, has_dst
+#}}}
+
+def operands( _table ):#{{{
+    """Returns an array of packed operand words, one for each opcode in a table of family ids"""
+    assert len( FAMILIES ) <= 256, "There are too many families to fit an 8 bit id into the operand words."
+
+    fields = family_fields()
+    words = array( "I", bytes( 4 * 2**16 ) )
+    for i in range( 2**16 ):
+        if _table[i] != 0:
+            words[i] = operand_word( i, _table[i], fields[ _table[i] ] )
+
+    return words
+#}}}
+
+#**************************
+#
+# Specialized handlers
+#
+#**************************
+
+# One handler per family leaves every handler switching on size and
+# addressing mode.  handlers() instead gives a separate handler id to each
+# ( family, size, opmode, source EA class, destination EA class ) combination
+# that actually turns up in the table, so that ae.js can be given a
+# straight-line handler for each one and dispatch on the id alone.
+#
+# The source is the family's effective address (whichever way the data goes)
+# and the destination is MOVE's second effective address.  The opmode is
+# only part of the key for the families that have a direction slot: an
+# *_OPMODE or *_OPMODE_EA (<ea>,Dn or Dn,<ea>, EXG's register pairs, ...),
+# *_RM (Dn or -(An)), *_dr (register to memory or back) or *_b (Dn or An).
+# Where an *_OPMODE only gives the size, as for CMP, the size already tells
+# the handlers apart and the opmode adds nothing.  The shift count's *_i/r
+# isn't a direction, and for everything else the opmode is 0.
+
+DIRECTION_SUFFIXES = ( "_OPMODE", "_OPMODE_EA", "_RM", "_dr", "_b" )
+
+EA_CLASSES = [ #{{{
+    "none",
+    "Dn",           # 000
+    "An",           # 001
+    "(An)",         # 010
+    "(An)+",        # 011
+    "-(An)",        # 100
+    "(d16,An)",     # 101
+    "(d8,An,Xn)",   # 110
+    "(xxx).W",      # 111 000
+    "(xxx).L",      # 111 001
+    "(d16,PC)",     # 111 010
+    "(d8,PC,Xn)",   # 111 011
+    "#<data>",      # 111 100
+]#}}}
+
+def ea_class( _mode, _reg ):#{{{
+    """Returns the index into EA_CLASSES of an effective address mode and register"""
+    return _mode + 1 if _mode < 7 else 8 + _reg
+#}}}
+
+def unpack_field( _word, _field ):#{{{
+    """Returns one of the OPERAND_FIELDS of an operand word"""
+    shift, width = OPERAND_FIELDS[ _field ]
+    return ( _word >> shift ) & ( ( 1 << width ) - 1 )
+#}}}
+
+def directed_families():#{{{
+    """Returns a list saying which families, by id, have a direction slot packed into the opmode"""
+    directed = []
+
+    for fields in family_fields():
+        directed.append( any(
+            slot.endswith( DIRECTION_SUFFIXES ) and slot_field( slot, shift, width ) in ( "opmode", "opmode_ea" )
+            for slot, shift, width in fields ) )
+
+    return directed
+#}}}
+
+def handlers( _table, _operands ):#{{{
+    """Returns ( handler ids, manifest ), where manifest[ id - 1 ] is ( family, size, opmode, src class, dst class )"""
+
+    has_ea, has_dst = ea_slots()
+    directed = directed_families()
+
+    keys = [ None ] * 2**16
+    for i in range( 2**16 ):
+        family = _table[i]
+        if family == 0:
+            continue
+
+        word = _operands[i]
+        src  = ea_class( unpack_field( word, "ea_mode" ), unpack_field( word, "ea_reg" ) ) if has_ea[ family ] else 0
+        dst  = ea_class( unpack_field( word, "dst_mode" ), unpack_field( word, "dst_reg" ) ) if has_dst[ family ] else 0
+        mode = unpack_field( word, "opmode" ) if directed[ family ] else 0
+
+        keys[i] = ( family, unpack_field( word, "size" ), mode, src, dst )
+
+    # sorting the combinations keeps each family's handlers together, and the
+    # ids stable from one run to the next
+    manifest = sorted( set( key for key in keys if key != None ) )
+    ids      = dict( ( key, i + 1 ) for i, key in enumerate( manifest ) )
+
+    table = array( "H", bytes( 2 * 2**16 ) )
+    for i in range( 2**16 ):
+        if keys[i] != None:
+            table[i] = ids[ keys[i] ]
+
+    return table, manifest
+#}}}
+
+def handler_listing( _manifest ):#{{{
+    """Prints the handler manifest, one handler per line"""
+    sizes    = [ "B", "W", "L", "-" ]
+    directed = directed_families()
+    for i, ( family, size, mode, src, dst ) in enumerate( _manifest ):
+        name = FAMILIES[ family ]["name"]
+        if directed[ family ]:
+            name += "/%d" % mode
+        print( "{:4d} {:s}.{:s} {:s} -> {:s}".format(
+            i + 1, name, sizes[ size ], EA_CLASSES[ src ], EA_CLASSES[ dst ] ) )
+#}}}
+
+#**************************
+#
+# Instruction lengths
+#
+#**************************
+
+# The total length of an instruction, in words, follows from its first word:
+# one for the opcode, whatever extension words the family always has
+# (immediates, displacements, register masks, ...) and the extension words
+# of its effective addresses.  EXTENSION_WORDS lists the first kind, as a
+# number of words or as
+#
+#     "imm"   an immediate of the instruction's size: 1 word for byte and
+#             word, 2 for long, none if unsized (TRAPcc with no operand)
+#     "disp"  a Bcc displacement: 1 word if the 8 bit displacement is $00,
+#             2 if it is $FF (68020+), otherwise none
+#
+# The length table holds the length in its low bits, and LENGTH_DEPENDS is
+# set when the real length can only be found from an extension word, which
+# is the case for the indexed modes, (d8,An,Xn) and (d8,PC,Xn), since on the
+# 68020 those can be in the full extension format.
+
+EXTENSION_WORDS = { #{{{
+    "ORI to CCR"    : 1,
+    "ORI to SR"     : 1,
+    "ORI"           : "imm",
+    "ANDI to CCR"   : 1,
+    "ANDI to SR"    : 1,
+    "ANDI"          : "imm",
+    "SUBI"          : "imm",
+    "CALLM"         : 1,
+    "ADDI"          : "imm",
+    "CMP2/CHK2"     : 1,
+    "EORI_to_CCR"   : 1,
+    "EORI_to_SR"    : 1,
+    "EORI"          : "imm",
+    "CMPI"          : "imm",
+    "BTST_STATIC"   : 1,
+    "BCHG_STATIC"   : 1,
+    "BSET_STATIC"   : 1,
+    "MOVES"         : 1,
+    "CAS"           : 1,
+    "CAS2"          : 2,
+    "MOVEP"         : 1,
+    "LINK_LONG"     : 2,
+    "LINK_WORD"     : 1,
+    "MUL_LONG"      : 1,
+    "DIV_LONG"      : 1,
+    "STOP"          : 1,
+    "RTD"           : 1,
+    "MOVEC"         : 1,
+    "MOVEM"         : 1,
+    "DBcc"          : 1,
+    "TRAPcc"        : "imm",
+    "BRA"           : "disp",
+    "BSR"           : "disp",
+    "Bcc"           : "disp",
+    "PACK"          : 1,
+    "UNPK"          : 1,
+    "BFTST"         : 1,
+    "BFEXTU"        : 1,
+    "BFCHG"         : 1,
+    "BFEXTS"        : 1,
+    "BFCLR"         : 1,
+    "BFFFO"         : 1,
+    "BFSET"         : 1,
+    "BFINS"         : 1,
+}#}}}
+
+# Families with no size slot whose effective address is still of a known
+# size, which matters for how long a #<data> operand is
+EA_SIZES = { #{{{
+    "MUL_LONG"      : 2,
+    "DIV_LONG"      : 2,
+}#}}}
+
+LENGTH_DEPENDS = 0x80
+
+def ea_words( _mode, _reg, _size ):#{{{
+    """Returns ( words, depends ) for the extension words of an effective address"""
+    if _mode == 5:                  # (d16,An)
+        return 1, False
+    if _mode == 6:                  # (d8,An,Xn), or the full format
+        return 1, True
+    if _mode == 7:
+        if _reg == 0:               # (xxx).W
+            return 1, False
+        if _reg == 1:               # (xxx).L
+            return 2, False
+        if _reg == 2:               # (d16,PC)
+            return 1, False
+        if _reg == 3:               # (d8,PC,Xn), or the full format
+            return 1, True
+        if _reg == 4:               # #<data>
+            return ( 2 if _size == 2 else 1 ), False
+    return 0, False
+#}}}
+
+def lengths( _table, _operands ):#{{{
+    """Returns a uint8 array with the length in words of every opcode, or'd with LENGTH_DEPENDS where needed"""
+    has_ea, has_dst = ea_slots()
+    table           = array( "B", bytes( 2**16 ) )
+
+    for i in range( 2**16 ):
+        family = _table[i]
+        if family == 0:
+            continue
+
+        word    = _operands[i]
+        size    = unpack_field( word, "size" )
+        words   = 1
+        depends = False
+
+        name      = FAMILIES[ family ]["name"]
+        extension = EXTENSION_WORDS.get( name, 0 )
+        if extension == "imm":
+            words += { 0:1, 1:1, 2:2, SIZE_UNSIZED:0 }[ size ]
+        elif extension == "disp":
+            words += { 0x00:1, 0xFF:2 }.get( unpack_field( word, "data" ), 0 )
+        else:
+            words += extension
+
+        if has_ea[ family ]:
+            n, d     = ea_words( unpack_field( word, "ea_mode" ), unpack_field( word, "ea_reg" ), EA_SIZES.get( name, size ) )
+            words   += n
+            depends |= d
+
+        if has_dst[ family ]:
+            n, d     = ea_words( unpack_field( word, "dst_mode" ), unpack_field( word, "dst_reg" ), size )
+            words   += n
+            depends |= d
+
+        table[i] = words | ( LENGTH_DEPENDS if depends else 0 )
+
+    return table
+#}}}
+
+#**************************
+#
+# Cycle timing
+#
+#**************************
+
+# Base 68000 cycle counts for each opcode, so that timing an instruction
+# against the custom chips is a single lookup.  A timing is the family's
+# execution time from CYCLES plus the time to calculate its effective
+# addresses, from EA_CYCLES.
+#
+# Each CYCLES entry is ( byte/word, long, byte/word memory, long memory ),
+# where the "memory" times are used when the operand is in memory, and the
+# EA calculation time is added on top of that.  What counts as "in memory"
+# is the EA's mode, unless a fifth element says otherwise:
+#
+#     "dir"  bit 2 of the opmode: the result goes to <ea> rather than Dn
+#     "rm"   the R/M bit: -(Ay),-(Ax) rather than Dy,Dx
+#
+# The control-addressing instructions have their own timing for each mode,
+# which is given in CONTROL_CYCLES instead.  Families that aren't in either
+# (the 68010/68020 additions) get a timing of 0.
+#
+# Some timings can only be known at run time: multiply and divide depend on
+# the operands, MOVEM on the register list, and the conditional instructions
+# on whether the condition holds.  Those families are in TIMED_AT_RUNTIME,
+# and have TIMING_DEPENDS set; their base is MOVEM with no registers, the
+# slowest DIVU/DIVS, MULU/MULS with no extra cycles, a taken branch, and
+# Scc/DBcc with the condition false (so DBcc loops back).  Multiply and
+# divide have tables of their own, in multiply_divide_tables().
+#
+# A register shift or rotate takes 2 more cycles for each bit of the count.
+# When the count is in the opcode, timings() adds those in; when it's in a
+# register, the base is a shift by 0, TIMING_DEPENDS is set, and the count
+# has to be looked up in SHCY.  Memory shifts are always by 1, and take the
+# memory timing from CYCLES.
+
+CYCLES = { #{{{
+    "ORI to CCR"    : ( 20, 20, 20, 20 ),
+    "ORI to SR"     : ( 20, 20, 20, 20 ),
+    "ORI"           : (  8, 16, 12, 20 ),
+    "ANDI to CCR"   : ( 20, 20, 20, 20 ),
+    "ANDI to SR"    : ( 20, 20, 20, 20 ),
+    "ANDI"          : (  8, 14, 12, 20 ),
+    "SUBI"          : (  8, 16, 12, 20 ),
+    "ADDI"          : (  8, 16, 12, 20 ),
+    "EORI_to_CCR"   : ( 20, 20, 20, 20 ),
+    "EORI_to_SR"    : ( 20, 20, 20, 20 ),
+    "EORI"          : (  8, 16, 12, 20 ),
+    "CMPI"          : (  8, 14,  8, 12 ),
+    "BTST_DYNAMIC"  : (  6,  6,  4,  4 ),
+    "BTST_STATIC"   : ( 10, 10,  8,  8 ),
+    "BCHG_STATIC"   : ( 12, 12, 12, 12 ),
+    "BCHG_DYNAMIC"  : (  8,  8,  8,  8 ),
+    "BCLR"          : ( 10, 10,  8,  8 ),
+    "BSET_STATIC"   : ( 12, 12, 12, 12 ),
+    "BSET_DYNAMIC"  : (  8,  8,  8,  8 ),
+    "MOVEP"         : ( 16, 24, 16, 24 ),
+    "MOVEA"         : (  4,  4,  4,  4 ),
+    "MOVE"          : (  4,  4,  4,  4 ),
+    "MOVE_from_SR"  : (  6,  6,  8,  8 ),
+    "NEGX"          : (  4,  6,  8, 12 ),
+    "CLR"           : (  4,  6,  8, 12 ),
+    "MOVE_to_CCR"   : ( 12, 12, 12, 12 ),
+    "NEG"           : (  4,  6,  8, 12 ),
+    "NOT"           : (  4,  6,  8, 12 ),
+    "MOVE_to_SR"    : ( 12, 12, 12, 12 ),
+    "EXT"           : (  4,  4,  4,  4 ),
+    "LINK_WORD"     : ( 16, 16, 16, 16 ),
+    "NBCD"          : (  6,  6,  8,  8 ),
+    "SWAP"          : (  4,  4,  4,  4 ),
+    "ILLEGAL"       : ( 34, 34, 34, 34 ),
+    "TAS"           : (  4,  4, 10, 10 ),
+    "TST"           : (  4,  4,  4,  4 ),
+    "MULU_WORD"     : ( 38, 38, 38, 38 ),
+    "MULS_WORD"     : ( 38, 38, 38, 38 ),
+    "DIVS_WORD"     : (158,158,158,158 ),
+    "DIVU_WORD"     : (140,140,140,140 ),
+    "TRAP"          : ( 34, 34, 34, 34 ),
+    "UNLK"          : ( 12, 12, 12, 12 ),
+    "MOVE_USP"      : (  4,  4,  4,  4 ),
+    "RESET"         : (132,132,132,132 ),
+    "NOP"           : (  4,  4,  4,  4 ),
+    "STOP"          : (  4,  4,  4,  4 ),
+    "RTE"           : ( 20, 20, 20, 20 ),
+    "RTS"           : ( 16, 16, 16, 16 ),
+    "TRAPV"         : (  4,  4,  4,  4 ),
+    "RTR"           : ( 20, 20, 20, 20 ),
+    "CHK"           : ( 10, 10, 10, 10 ),
+    "ADDQ"          : (  4,  8,  8, 12 ),
+    "SUBQ"          : (  4,  8,  8, 12 ),
+    "DBcc"          : ( 10, 10, 10, 10 ),
+    "Scc"           : (  4,  4,  8,  8 ),
+    "BRA"           : ( 10, 10, 10, 10 ),
+    "BSR"           : ( 18, 18, 18, 18 ),
+    "Bcc"           : ( 10, 10, 10, 10 ),
+    "MOVEQ"         : (  4,  4,  4,  4 ),
+    "SBCD"          : (  6,  6, 18, 18, "rm" ),
+    "OR"            : (  4,  6,  8, 12, "dir" ),
+    "SUBX"          : (  4,  8, 18, 30, "rm" ),
+    "SUB"           : (  4,  6,  8, 12, "dir" ),
+    "SUBA"          : (  8,  8,  8,  6 ),
+    "CMPM"          : ( 12, 20, 12, 20 ),
+    "CMP"           : (  4,  6,  4,  6 ),
+    "CMPA"          : (  6,  6,  6,  6 ),
+    "EOR"           : (  4,  8,  8, 12 ),
+    "ABCD"          : (  6,  6, 18, 18, "rm" ),
+    "EXG"           : (  6,  6,  6,  6 ),
+    "AND"           : (  4,  6,  8, 12, "dir" ),
+    "ADDX"          : (  4,  8, 18, 30, "rm" ),
+    "ADDA"          : (  8,  8,  8,  6 ),
+    "ADD"           : (  4,  6,  8, 12, "dir" ),
+    "ASL"           : (  6,  8,  8,  8 ),
+    "ASR"           : (  6,  8,  8,  8 ),
+    "LSL"           : (  6,  8,  8,  8 ),
+    "LSR"           : (  6,  8,  8,  8 ),
+    "ROXL"          : (  6,  8,  8,  8 ),
+    "ROXR"          : (  6,  8,  8,  8 ),
+    "ROL"           : (  6,  8,  8,  8 ),
+    "ROR"           : (  6,  8,  8,  8 ),
+}#}}}
+
+CONTROL_CYCLES = { #{{{
+    #                (An) (d16,An) (d8,An,Xn) (xxx).W (xxx).L (d16,PC) (d8,PC,Xn)
+    "LEA"   : dict( zip( EA_CLASSES[3:4] + EA_CLASSES[6:12], (  4,  8, 12,  8, 12,  8, 12 ) ) ),
+    "PEA"   : dict( zip( EA_CLASSES[3:4] + EA_CLASSES[6:12], ( 12, 16, 20, 16, 20, 16, 20 ) ) ),
+    "JMP"   : dict( zip( EA_CLASSES[3:4] + EA_CLASSES[6:12], (  8, 10, 14, 10, 12, 10, 14 ) ) ),
+    "JSR"   : dict( zip( EA_CLASSES[3:4] + EA_CLASSES[6:12], ( 16, 18, 22, 18, 20, 18, 22 ) ) ),
+
+    # registers to memory; memory to registers takes MOVEM_TO_REGISTERS more,
+    # which timings() adds from the dr bit.  Either way the runtime adds 4
+    # (word) or 8 (long) for each register.
+    "MOVEM" : dict( zip( EA_CLASSES[3:12], (  8,  8,  8, 12, 14, 12, 16, 12, 14 ) ) ),
+}#}}}
+
+MOVEM_TO_REGISTERS = 4
+
+# Families that take longer than their CYCLES entry says when the
+# destination is an address register, which CYCLES counts as a register:
+# ADDQ and SUBQ to An always work on the whole 32 bits
+ADDRESS_REGISTER_CYCLES = { #{{{
+    #               byte/word  long
+    "ADDQ"          : ( 8, 8 ),
+    "SUBQ"          : ( 8, 8 ),
+}#}}}
+
+EA_CYCLES = { #{{{
+    #            byte/word  long
+    "none"       : ( 0,  0 ),
+    "Dn"         : ( 0,  0 ),
+    "An"         : ( 0,  0 ),
+    "(An)"       : ( 4,  8 ),
+    "(An)+"      : ( 4,  8 ),
+    "-(An)"      : ( 6, 10 ),
+    "(d16,An)"   : ( 8, 12 ),
+    "(d8,An,Xn)" : (10, 14 ),
+    "(xxx).W"    : ( 8, 12 ),
+    "(xxx).L"    : (12, 16 ),
+    "(d16,PC)"   : ( 8, 12 ),
+    "(d8,PC,Xn)" : (10, 14 ),
+    "#<data>"    : ( 4,  8 ),
+}#}}}
+
+TIMED_AT_RUNTIME = set( [
+    "MULU_WORD", "MULS_WORD", "DIVU_WORD", "DIVS_WORD",
+    "MOVEM", "Bcc", "DBcc", "Scc",
+] )
+
+SHIFT_CYCLES_PER_BIT = 2
+
+TIMING_DEPENDS = 0x8000
+
+def timings( _table, _operands ):#{{{
+    """Returns a uint16 array with the base 68000 cycle count of every opcode, or'd with TIMING_DEPENDS where needed"""
+    has_ea, has_dst = ea_slots()
+    table           = array( "H", bytes( 2 * 2**16 ) )
+
+    for i in range( 2**16 ):
+        family = _table[i]
+        name   = FAMILIES[ family ]["name"]
+        if family == 0 or ( name not in CYCLES and name not in CONTROL_CYCLES ):
+            continue
+
+        word    = _operands[i]
+        long    = unpack_field( word, "size" ) == 2
+        depends = name in TIMED_AT_RUNTIME
+        src  = EA_CLASSES[ ea_class( unpack_field( word, "ea_mode" ), unpack_field( word, "ea_reg" ) ) ] if has_ea[ family ] else "none"
+        dst  = EA_CLASSES[ ea_class( unpack_field( word, "dst_mode" ), unpack_field( word, "dst_reg" ) ) ] if has_dst[ family ] else "none"
+
+        if name in CONTROL_CYCLES:
+            cycles = CONTROL_CYCLES[ name ][ src ]
+            if name == "MOVEM" and unpack_field( word, "opmode" ) & 1:
+                cycles += MOVEM_TO_REGISTERS
+
+        elif name in ADDRESS_REGISTER_CYCLES and src == "An":
+            cycles = ADDRESS_REGISTER_CYCLES[ name ][ long ]
+
+        else:
+            timing = CYCLES[ name ]
+            memory = timing[4] if len( timing ) > 4 else "ea"
+            opmode = unpack_field( word, "opmode" )
+
+            if memory == "dir":
+                memory = opmode & 4
+            elif memory == "rm":
+                memory = opmode & 1
+            else:
+                memory = src not in ( "none", "Dn", "An" )
+
+            cycles  = timing[ ( 2 if memory else 0 ) + ( 1 if long else 0 ) ]
+            cycles += EA_CYCLES[ src ][ long ]
+
+            # writing to -(An) costs the same as writing to (An)
+            cycles += EA_CYCLES[ "(An)" if dst == "-(An)" else dst ][ long ]
+
+            # register shifts and rotates have the size in bits 7-6, where
+            # the memory ones have 11, and i/r in bit 5: 0 for a count in
+            # bits 11-9, 1 for a count in the register there
+            if name in SHIFT_KINDS and ( i >> 6 ) & 3 != 3:
+                if i & 0x20:
+                    depends = True
+                else:
+                    cycles += SHIFT_CYCLES_PER_BIT * SHIFT_IMMEDIATES[ ( i >> 9 ) & 7 ]
+
+        table[i] = cycles | ( TIMING_DEPENDS if depends else 0 )
+
+    return table
+#}}}
+
+#**************************
+#
+# Condition code effects
+#
+#**************************
+
+# For each opcode, a mask of the CCR flags it reads (low byte) and the ones it
+# writes (high byte), with each flag in the same bit as in the CCR itself.
+# With these the emulator can put off working out the flags of an ALU
+# operation, and not work them out at all if the next instruction that
+# touches them overwrites them before anything reads them.
+
+CCR_BITS = { "X" : 0x10, "N" : 0x08, "Z" : 0x04, "V" : 0x02, "C" : 0x01 }
+
+# The families that can take an exception, and so push SR, depending on
+# their operands, the flags or the privilege level: the conditional traps,
+# divide by zero, and the privileged instructions in user mode.  Their
+# reads have CCR_MAY_TRAP set, and the emulator has to work out every
+# pending flag before it raises the exception.  (Trace, interrupts and bus
+# and address errors can happen anywhere, and aren't marked.)
+MAY_TRAP = set( [
+    "TRAPV", "TRAPcc", "CHK", "CMP2/CHK2",
+    "DIVS_WORD", "DIVU_WORD", "DIV_LONG",
+    "ORI to SR", "ANDI to SR", "EORI_to_SR", "MOVE_to_SR", "MOVE_USP",
+    "MOVEC", "MOVES", "RESET", "STOP", "RTE",
+] )
+
+CCR_MAY_TRAP = 0x80
+
+# the flags tested by each of the 16 conditions, T F HI LS CC CS NE EQ VC VS
+# PL MI GE LT GT LE
+CONDITION_FLAGS = [ "", "", "ZC", "ZC", "C", "C", "Z", "Z", "V", "V", "N", "N", "NV", "NV", "NZV", "NZV" ]
+
+def ccr_mask( _flags ):#{{{
+    """Returns the CCR bits of a string of flag letters"""
+    mask = 0
+    for flag in _flags:
+        mask |= CCR_BITS[ flag ]
+    return mask
+#}}}
+
+def undeclared_ccr_effects():#{{{
+    """Returns the names of the families that are missing from CCR_EFFECTS"""
+    return [ family["name"] for family in FAMILIES[1:] if family["name"] not in CCR_EFFECTS ]
+#}}}
+
+def ccr_effects( _table, _operands ):#{{{
+    """Returns a uint16 array with the CCR flags each opcode reads (low byte) and writes (high byte)"""
+    table = array( "H", bytes( 2 * 2**16 ) )
+
+    for i in range( 2**16 ):
+        family = _table[i]
+        if family == 0:
+            continue
+
+        name          = FAMILIES[ family ]["name"]
+        reads, writes = CCR_EFFECTS[ name ]
+
+        if reads == "cc":
+            reads = CONDITION_FLAGS[ unpack_field( _operands[i], "cond" ) ]
+
+        # ADDQ and SUBQ to an address register leave the flags alone
+        if name in ( "ADDQ", "SUBQ" ) and unpack_field( _operands[i], "ea_mode" ) == 1:
+            writes = ""
+
+        # a shift by a register that holds 0 leaves X alone, so X only counts
+        # as written when the count is in the opcode: i/r, bit 5, is 0 (the
+        # memory shifts, with 11 in bits 7-6, always shift by 1)
+        if name in SHIFT_KINDS and "X" in writes and ( i >> 6 ) & 3 != 3 and i & 0x20:
+            writes = writes.replace( "X", "" )
+
+        table[i] = ccr_mask( reads ) | ( ccr_mask( writes ) << 8 )
+        if name in MAY_TRAP:
+            table[i] |= CCR_MAY_TRAP
+
+    return table
+#}}}
+
+#**************************
+#
+# Condition tests
+#
+#**************************
+
+# Bcc, DBcc, Scc and TRAPcc all pick one of the 16 conditions with a four
+# bit field, and every condition only depends on the five CCR flags, so
+# each one can be tested with a single load instead of flag logic:
+#
+#     CONDITION_TABLE[ condition * 32 + ( ccr & 0x1F ) ]      0 or 1
+#     ( CONDITION_MASKS[ ccr & 0x1F ] >> condition ) & 1     the same, packed
+#
+# X is never tested, so the two halves of each row are the same.
+
+CONDITIONS = [ "T", "F", "HI", "LS", "CC", "CS", "NE", "EQ", "VC", "VS", "PL", "MI", "GE", "LT", "GT", "LE" ]
+
+def condition_holds( _condition, _ccr ):#{{{
+    """Returns whether one of the 16 conditions holds for a CCR value, the slow way"""
+    n = bool( _ccr & CCR_BITS["N"] )
+    z = bool( _ccr & CCR_BITS["Z"] )
+    v = bool( _ccr & CCR_BITS["V"] )
+    c = bool( _ccr & CCR_BITS["C"] )
+
+    return [ True,            False,
+             not c and not z, c or z,
+             not c,           c,
+             not z,           z,
+             not v,           v,
+             not n,           n,
+             n == v,          n != v,
+             not z and n == v, z or n != v ][ _condition ]
+#}}}
+
+def condition_table():#{{{
+    """Returns a uint8 array that says whether each condition holds for each of the 32 CCR states"""
+    return array( "B", [ int( condition_holds( condition, ccr ) ) for condition in range( 16 ) for ccr in range( 32 ) ] )
+#}}}
+
+def condition_masks():#{{{
+    """Returns a uint16 array with, for each of the 32 CCR states, one bit per condition that holds"""
+    masks = array( "H", bytes( 2 * 32 ) )
+
+    for ccr in range( 32 ):
+        for condition in range( 16 ):
+            if condition_holds( condition, ccr ):
+                masks[ ccr ] |= 1 << condition
+
+    return masks
+#}}}
+
+#**************************
+#
+# Extension word variants
+#
+#**************************
+
+# The families in EXTENSION_VARIANTS share their whole first word, so the
+# opcode table can only give their combined id.  For each of them, one bit
+# of the extension word says which instruction it really is, so decoding is
+# just a second lookup:
+#
+#     bit = XBIT[ family ]                                 (255 if there is nothing to look up)
+#     variant = XVAR[ family * 2 + ( extension >> bit & 1 ) ]
+#
+# The variant ids index VARIANTS, which is separate from FAMILIES since the
+# variants never appear in the opcode table themselves.  Id 0 is "none".
+
+# combined family : ( bit of the extension word that decides, [ variant if 0, variant if 1 ] )
+EXTENSION_VARIANTS = {
+    "CMP2/CHK2"     : ( 11, [ "CMP2", "CHK2" ] ),
+}
+
+VARIANTS    = [ None ] + [ v for op in OPCODES if op in EXTENSION_VARIANTS for v in EXTENSION_VARIANTS[ op ][1] ]
+VARIANT_IDS = dict( ( name, i ) for i, name in enumerate( VARIANTS ) if i != 0 )
+
+def variant_tables():#{{{
+    """Returns the XBIT and XVAR arrays for the extension word variant lookup"""
+    bits     = array( "B", [ 255 ] * len( FAMILIES ) )
+    variants = array( "B", bytes( 2 * len( FAMILIES ) ) )
+
+    for name in EXTENSION_VARIANTS:
+        if name not in FAMILY_IDS:
+            continue
+
+        family = FAMILY_IDS[ name ]
+        bit, names = EXTENSION_VARIANTS[ name ]
+
+        bits[ family ] = bit
+        for i in range( 2 ):
+            variants[ family * 2 + i ] = VARIANT_IDS[ names[i] ]
+
+    return bits, variants
+#}}}
+
+def variant_lookup( _bits, _variants, _family, _extension ):#{{{
+    """Returns the name of the variant a family's extension word selects, or None"""
+    bit = _bits[ _family ]
+    if bit == 255:
+        return None
+
+    return VARIANTS[ _variants[ _family * 2 + ( ( _extension >> bit ) & 1 ) ] ]
+#}}}
+
+def variant_names():#{{{
+    """Packs the VARIANTS table for the XNAM section, as a length and ASCII name per id"""
+    table = array( "B" )
+
+    for name in VARIANTS:
+        name = ( name or "" ).encode( "ascii" )
+        table.append( len( name ) )
+        table.frombytes( name )
+
+    return table
+#}}}
+
+#**************************
+#
+# Extension words
+#
+#**************************
+
+# The 68020 families below are decoded from their first extension word as
+# much as from the opcode.  EXTENSION_TEMPLATES describes that word the same
+# way OPCODES describes the first one, and each family gets a secondary
+# table that is indexed by the bits of its extension word that pick
+# registers, sizes and modes (the "key" bits), and holds those fields
+# already unpacked, laid out as EXTENSION_FIELDS.
+#
+# Fields that are plain data (bitfield offsets and widths, the MOVEC control
+# register, the CALLM argument count) are left in the extension word, since
+# keying on them would only make the tables bigger.  So is the CMP2/CHK2
+# bit, which XBIT and XVAR already decode.  CAS2 has a second
+# extension word, laid out like the first one, which is looked up the same way.
+
+# Every slot name here is also the name of its pattern.
+EXTENSION_PATTERNS = { #{{{
+    "X_REGISTER4" : COMMON_PATTERNS[ "vector4" ], # D/A bit and register number
+    "X_REGISTER"  : COMMON_PATTERNS[ "vector3" ],
+    "X_REGISTER2" : COMMON_PATTERNS[ "vector3" ],
+    "X_REGISTER3" : COMMON_PATTERNS[ "vector3" ],
+    "X_SIGNED"    : COMMON_PATTERNS[ "b" ],
+    "X_SIZE"      : COMMON_PATTERNS[ "b" ],
+    "X_dr"        : COMMON_PATTERNS[ "b" ],
+    "X_Do"        : COMMON_PATTERNS[ "b" ],
+    "X_Dw"        : COMMON_PATTERNS[ "b" ],
+    "X_VARIANT"   : COMMON_PATTERNS[ "b" ], # decoded by XBIT/XVAR, see EXTENSION_VARIANTS
+    "X_OFFSET"    : [ [ "b", "vector4" ] ],
+    "X_WIDTH"     : [ [ "b", "vector4" ] ],
+    "X_CONTROL"   : [ [ "vector4", "vector4", "vector4" ] ],
+    "X_COUNT"     : [ [ "vector4", "vector4" ] ],
+}#}}}
+
+PATTERNS.update( EXTENSION_PATTERNS )
+
+# Which field of the table entries each slot of an extension template fills;
+# None means the slot is data, and not part of the key.
+EXTENSION_SLOTS = { #{{{
+    "X_REGISTER4" : "reg",
+    "X_REGISTER"  : "reg",
+    "X_REGISTER2" : "reg2",
+    "X_REGISTER3" : "reg3",
+    "X_SIGNED"    : "signed",
+    "X_SIZE"      : "size",
+    "X_dr"        : "dr",
+    "X_Do"        : "do",
+    "X_Dw"        : "dw",
+    "X_VARIANT"   : None,
+    "X_OFFSET"    : None,
+    "X_WIDTH"     : None,
+    "X_CONTROL"   : None,
+    "X_COUNT"     : None,
+}#}}}
+
+BITFIELD_EXTENSION = [0,0,0,0,"X_Do","X_OFFSET","X_Dw","X_WIDTH"]
+
+EXTENSION_TEMPLATES = { #{{{
+    "CALLM"         : [0,0,0,0,0,0,0,0,"X_COUNT"],
+    "CMP2/CHK2"     : ["X_REGISTER4","X_VARIANT",0,0,0,0,0,0,0,0,0,0,0],
+    "MOVES"         : ["X_REGISTER4","X_dr",0,0,0,0,0,0,0,0,0,0,0],
+    "CAS"           : [0,0,0,0,0,0,0,"X_REGISTER2",0,0,0,"X_REGISTER3"],
+    "CAS2"          : ["X_REGISTER4",0,0,0,"X_REGISTER2",0,0,0,"X_REGISTER3"],
+    "MUL_LONG"      : [0,"X_REGISTER","X_SIGNED","X_SIZE",0,0,0,0,0,0,0,"X_REGISTER2"],
+    "DIV_LONG"      : [0,"X_REGISTER","X_SIGNED","X_SIZE",0,0,0,0,0,0,0,"X_REGISTER2"],
+    "MOVEC"         : ["X_REGISTER4","X_CONTROL"],
+    "BFTST"         : BITFIELD_EXTENSION,
+    "BFEXTU"        : [0,"X_REGISTER"] + BITFIELD_EXTENSION[4:],
+    "BFCHG"         : BITFIELD_EXTENSION,
+    "BFEXTS"        : [0,"X_REGISTER"] + BITFIELD_EXTENSION[4:],
+    "BFCLR"         : BITFIELD_EXTENSION,
+    "BFFFO"         : [0,"X_REGISTER"] + BITFIELD_EXTENSION[4:],
+    "BFSET"         : BITFIELD_EXTENSION,
+    "BFINS"         : [0,"X_REGISTER"] + BITFIELD_EXTENSION[4:],
+}#}}}
+
+# field : ( shift, width ) in an entry of a secondary table
+EXTENSION_FIELDS = { #{{{
+    "reg"     : (  0, 4 ), # Dl, Dq, Rn or the bitfield register; 8-15 are A0-A7
+    "reg2"    : (  4, 4 ), # Dh, Dr or Du
+    "reg3"    : (  8, 4 ), # Dc
+    "signed"  : ( 12, 1 ),
+    "size"    : ( 13, 1 ), # 64 bit product or dividend
+    "dr"      : ( 14, 1 ),
+    "do"      : ( 15, 1 ),
+    "dw"      : ( 16, 1 ),
+}#}}}
+
+# Each family's descriptor in the XDSC section is EXTENSION_STRIDE uint16s:
+# the offset of its table in XTAB (0xFFFF if it has none), the mask and value
+# of the static bits every valid extension word has, the number of runs of
+# key bits, and then ( shift, width ) for each run, most significant first.
+# The index into the family's table is those runs, concatenated.
+EXTENSION_RUNS   = 4
+EXTENSION_STRIDE = 4 + 2 * EXTENSION_RUNS
+
+def key_runs( _mask ):#{{{
+    """Splits a mask into ( shift, width ) runs of contiguous bits, most significant first"""
+    result = []
+    shift  = 16
+    while shift > 0:
+        shift -= 1
+        if _mask >> shift & 1:
+            top = shift
+            while shift > 0 and _mask >> ( shift - 1 ) & 1:
+                shift -= 1
+            result.append( ( shift, top - shift + 1 ) )
+
+    return result
+#}}}
+
+def extension_table( _name ):#{{{
+    """Returns the static mask and value, the key runs and the table entries of one family's extension word"""
+    rules = compile_bits( EXTENSION_TEMPLATES[ _name ] )
+
+    assert len( rules ) == 1, "The extension template for %s should compile to a single rule." % _name
+    width, mask, value, fields = rules[0]
+    assert width == 16, "The extension template for %s has length %d, when 16 is required." % ( _name, width )
+
+    keyed    = [ ( EXTENSION_SLOTS[ slot ], shift, w ) for slot, shift, w in fields if EXTENSION_SLOTS[ slot ] != None ]
+    key_mask = 0
+    for field, shift, w in keyed:
+        key_mask |= ( ( 1 << w ) - 1 ) << shift
+
+    runs    = key_runs( key_mask )
+    entries = array( "I" )
+    for index in range( 1 << sum( w for shift, w in runs ) ):
+
+        # scatter the index back into the bits of an extension word
+        word = value
+        rest = index
+        for shift, w in reversed( runs ):
+            word |= ( rest & ( ( 1 << w ) - 1 ) ) << shift
+            rest >>= w
+
+        entry = 0
+        for field, shift, w in keyed:
+            entry_shift, entry_width = EXTENSION_FIELDS[ field ]
+            entry |= ( ( word >> shift ) & ( ( 1 << w ) - 1 ) ) << entry_shift
+
+        entries.append( entry )
+
+    return mask, value, runs, entries
+#}}}
+
+def extension_tables():#{{{
+    """Returns the XDSC descriptors and the XTAB entries for every family with an extension template"""
+    descriptors = array( "H", [ 0xFFFF, 0, 0, 0 ] + [ 0 ] * ( 2 * EXTENSION_RUNS ) ) * len( FAMILIES )
+    entries     = array( "I" )
+
+    for name in EXTENSION_TEMPLATES:
+        if name not in FAMILY_IDS:
+            continue
+
+        mask, value, runs, table = extension_table( name )
+        assert len( runs ) <= EXTENSION_RUNS, "The key bits of %s's extension word are in too many pieces." % name
+        assert len( entries ) < 0xFFFF, "There are too many extension table entries for a 16 bit offset."
+
+        base = FAMILY_IDS[ name ] * EXTENSION_STRIDE
+        descriptors[ base:base + 4 ] = array( "H", [ len( entries ), mask, value, len( runs ) ] )
+        for i, ( shift, w ) in enumerate( runs ):
+            descriptors[ base + 4 + 2*i ] = shift
+            descriptors[ base + 5 + 2*i ] = w
+
+        entries.extend( table )
+
+    return descriptors, entries
+#}}}
+
+def extension_lookup( _descriptors, _entries, _family, _extension ):#{{{
+    """Returns the table entry for a family's extension word, or None if it has no table or the word is invalid"""
+    base = _family * EXTENSION_STRIDE
+    offset, mask, value, count = _descriptors[ base:base + 4 ]
+
+    if offset == 0xFFFF or _extension & mask != value:
+        return None
+
+    index = 0
+    for i in range( count ):
+        shift, w = _descriptors[ base + 4 + 2*i ], _descriptors[ base + 5 + 2*i ]
+        index = ( index << w ) | ( ( _extension >> shift ) & ( ( 1 << w ) - 1 ) )
+
+    return _entries[ offset + index ]
+#}}}
+
+def extension_field( _entry, _field ):#{{{
+    """Returns one of the EXTENSION_FIELDS of a secondary table entry"""
+    shift, width = EXTENSION_FIELDS[ _field ]
+    return ( _entry >> shift ) & ( ( 1 << width ) - 1 )
+#}}}
+
+#**************************
+#
+# Byte ALU tables
+#
+#**************************
+
+# The byte forms of the add and subtract families only have 256 x 256 (x 2
+# for X) possible inputs, so their results and flags can all be worked out
+# ahead of time.  Each entry is the result byte, with the CCR flags it sets
+# in the high byte, laid out like CCR_BITS:
+#
+#     entry = ALU[ ( x << 16 ) | ( destination << 8 ) | source ]    ADDX, SUBX
+#     entry = ALU[ ( destination << 8 ) | source ]                  ADD, SUB, CMP
+#     entry = ALU[ ( x << 8 ) | destination ]                       NEGX
+#     entry = ALU[ destination ]                                    NEG
+#
+# CMP leaves X alone, so its entries never have X set; CCR_EFFECTS says
+# which flags each family really writes.  ADDX, SUBX and NEGX only ever
+# clear Z, so in their tables Z means "the result is zero", and it has to
+# be ANDed into the old Z rather than copied.
+#
+# The tables are built with NumPy when it's there, and then checked against
+# alu_reference(), the one instruction at a time version.  Working out every
+# entry in Python would take longer than building the tables, so the check
+# is on every pair of ALU_EDGES (with X clear and set), which is where the
+# carries and overflows change, and a fixed random sample of ALU_SAMPLES
+# more.  Without NumPy, alu_reference() builds them on its own, just more
+# slowly.
+
+ALU_EDGES   = [ 0x00, 0x01, 0x0F, 0x10, 0x7E, 0x7F, 0x80, 0x81, 0xFE, 0xFF ]
+ALU_SAMPLES = 4096
+ALU_SEED    = 68000
+
+# ( section tag, family, whether it has a source operand, whether it takes X in )
+ALU_TABLES = [ #{{{
+    ( "ADDB", "ADD",  True,  False ),
+    ( "SUBB", "SUB",  True,  False ),
+    ( "CMPB", "CMP",  True,  False ),
+    ( "ADXB", "ADDX", True,  True  ),
+    ( "SBXB", "SUBX", True,  True  ),
+    ( "NEGB", "NEG",  False, False ),
+    ( "NGXB", "NEGX", False, True  ),
+]#}}}
+
+def alu_reference( _family, _dst, _src, _x ):#{{{
+    """Returns the table entry for one byte operation, worked out the obvious way"""
+    if _family in ( "NEG", "NEGX" ):
+        _dst, _src = 0, _dst # NEG is 0 - destination
+
+    if _family in ( "ADD", "ADDX" ):
+        total    = _dst + _src + _x
+        result   = total & 0xFF
+        carry    = total > 0xFF
+        overflow = ( _dst ^ result ) & ( _src ^ result ) & 0x80
+    else:
+        total    = _dst - _src - _x
+        result   = total & 0xFF
+        carry    = total < 0
+        overflow = ( _dst ^ _src ) & ( _dst ^ result ) & 0x80
+
+    flags = 0
+    if carry:
+        flags |= CCR_BITS["C"]
+        if _family != "CMP":
+            flags |= CCR_BITS["X"]
+    if overflow:
+        flags |= CCR_BITS["V"]
+    if result == 0:
+        flags |= CCR_BITS["Z"]
+    if result & 0x80:
+        flags |= CCR_BITS["N"]
+
+    return result | ( flags << 8 )
+#}}}
+
+def alu_index_operands( _index, _binary, _carry_in ):#{{{
+    """Returns the ( destination, source, x ) of an index into an ALU table"""
+    if _binary:
+        return ( _index >> 8 ) & 0xFF, _index & 0xFF, ( _index >> 16 ) if _carry_in else 0
+
+    return _index & 0xFF, 0, ( _index >> 8 ) if _carry_in else 0
+#}}}
+
+def alu_numpy( _family, _binary, _carry_in ):#{{{
+    """Returns the table for one byte operation as a numpy uint16 array, for every input at once"""
+    size  = ( 2**16 if _binary else 2**8 ) * ( 2 if _carry_in else 1 )
+    dst, src, x = alu_index_operands( numpy.arange( size, dtype=numpy.int32 ), _binary, _carry_in )
+
+    if not _binary:
+        dst, src = numpy.zeros_like( dst ), dst
+    if not _carry_in:
+        x = numpy.zeros_like( dst )
+
+    if _family in ( "ADD", "ADDX" ):
+        total    = dst + src + x
+        result   = total & 0xFF
+        carry    = total > 0xFF
+        overflow = ( ( dst ^ result ) & ( src ^ result ) & 0x80 ) != 0
+    else:
+        total    = dst - src - x
+        result   = total & 0xFF
+        carry    = total < 0
+        overflow = ( ( dst ^ src ) & ( dst ^ result ) & 0x80 ) != 0
+
+    flags = carry * CCR_BITS["C"] \
+          + overflow * CCR_BITS["V"] \
+          + ( result == 0 ) * CCR_BITS["Z"] \
+          + ( ( result & 0x80 ) != 0 ) * CCR_BITS["N"]
+    if _family != "CMP":
+        flags += carry * CCR_BITS["X"]
+
+    return ( result | ( flags << 8 ) ).astype( numpy.uint16 )
+#}}}
+
+def alu_samples( _binary, _carry_in ):#{{{
+    """Returns the indices of an ALU table that alu_table() checks: every pair of ALU_EDGES, and a fixed random sample"""
+    size    = ( 2**16 if _binary else 2**8 ) * ( 2 if _carry_in else 1 )
+    xs      = [ 0, 1 ] if _carry_in else [ 0 ]
+    indices = random.Random( ALU_SEED ).sample( range( size ), min( ALU_SAMPLES, size ) )
+
+    if _binary:
+        indices += [ ( x << 16 ) | ( dst << 8 ) | src for x in xs for dst in ALU_EDGES for src in ALU_EDGES ]
+    else:
+        indices += [ ( x << 8 ) | dst for x in xs for dst in ALU_EDGES ]
+
+    return sorted( set( indices ) )
+#}}}
+
+def alu_table( _family, _binary, _carry_in, _reference=alu_reference, _vectorized=alu_numpy, _exhaustive=False ):#{{{
+    """Returns the uint16 table for one byte operation, checked against the scalar reference if NumPy built it"""
+    size = ( 2**16 if _binary else 2**8 ) * ( 2 if _carry_in else 1 )
+
+    if numpy == None:
+        return array( "H", [ _reference( _family, *alu_index_operands( i, _binary, _carry_in ) ) for i in range( size ) ] )
+
+    table = array( "H", _vectorized( _family, _binary, _carry_in ).tolist() )
+    for i in ( range( size ) if _exhaustive else alu_samples( _binary, _carry_in ) ):
+        expected = _reference( _family, *alu_index_operands( i, _binary, _carry_in ) )
+        assert table[i] == expected, "The %s table has 0x%04X at index 0x%05X, but %s() says 0x%04X." \
+                % ( _family, table[i], i, _reference.__name__, expected )
+
+    return table
+#}}}
+
+def alu_tables():#{{{
+    """Returns ( tag, array ) artifact sections for every family in ALU_TABLES"""
+    return [ ( tag, alu_table( family, binary, carry_in ) ) for tag, family, binary, carry_in in ALU_TABLES ]
+#}}}
+
+#**************************
+#
+# BCD tables
+#
+#**************************
+
+# ABCD, SBCD and NBCD get the same treatment as the byte ALU tables, and are
+# indexed the same way as ADDX, SUBX and NEGX:
+#
+#     entry = BCD[ ( x << 16 ) | ( destination << 8 ) | source ]    ABCD, SBCD
+#     entry = BCD[ ( x << 8 ) | destination ]                       NBCD
+#
+# The 68000 does the binary add or subtract first, and then corrects it a
+# digit at a time.  ABCD adds 6 if the low digits summed to more than 9,
+# and 0x60 if the whole binary sum is more than 0x99 (which is also when it
+# carries).  SBCD and NBCD only subtract 6 when the low digit borrowed, and
+# 0x60 when the whole byte did, and borrow if the corrected result is below
+# 0.  That gives the same results as the real thing for operands that
+# aren't valid BCD too, e.g. ABCD 0x04 + 0x8F + X is 0x9A with no carry,
+# and SBCD 0x0A - 0x00 is 0x0A.
+#
+# N and V are "undefined" in the manual, but the 68000 sets N from bit 7 of
+# the corrected result, and sets V when the correction flips bit 7: from 0
+# to 1 for ABCD, and from 1 to 0 for SBCD and NBCD.  Z means "the result is
+# zero", to be ANDed into the old Z, as with ADDX.
+#
+# bcd_reference() follows those steps.  bcd_numpy() works from the carries
+# and borrows out of bits 3 and 7 instead, so the check between them is
+# between two different ways of getting the same answer.  Unlike the ALU
+# tables, every entry is checked.
+
+# ( section tag, family, whether it has a source operand )
+BCD_TABLES = [ #{{{
+    ( "ABCD", "ABCD", True  ),
+    ( "SBCD", "SBCD", True  ),
+    ( "NBCD", "NBCD", False ),
+]#}}}
+
+def bcd_reference( _family, _dst, _src, _x ):#{{{
+    """Returns the table entry for one BCD operation, worked out a digit at a time"""
+    if _family == "NBCD":
+        _dst, _src = 0, _dst # NBCD is 0 - destination
+
+    if _family == "ABCD":
+        binary     = _dst + _src + _x
+        correction = 0
+        if ( _dst & 0x0F ) + ( _src & 0x0F ) + _x > 9:
+            correction += 0x06
+        if binary > 0x99:
+            correction += 0x60
+
+        carry    = binary > 0x99
+        result   = ( binary + correction ) & 0xFF
+        overflow = ~binary & result & 0x80
+    else:
+        binary     = _dst - _src - _x
+        correction = 0
+        if ( _dst & 0x0F ) - ( _src & 0x0F ) - _x < 0:
+            correction += 0x06
+        if binary < 0:
+            correction += 0x60
+
+        carry    = binary - correction < 0
+        result   = ( binary - correction ) & 0xFF
+        overflow = binary & ~result & 0x80
+
+    flags = 0
+    if carry:
+        flags |= CCR_BITS["X"] | CCR_BITS["C"]
+    if overflow:
+        flags |= CCR_BITS["V"]
+    if result == 0:
+        flags |= CCR_BITS["Z"]
+    if result & 0x80:
+        flags |= CCR_BITS["N"]
+
+    return result | ( flags << 8 )
+#}}}
+
+def bcd_numpy( _family, _binary, _carry_in ):#{{{
+    """Returns the table for one BCD operation as a numpy uint16 array, for every input at once"""
+    size = ( 2**16 if _binary else 2**8 ) * 2
+    dst, src, x = alu_index_operands( numpy.arange( size, dtype=numpy.int32 ), _binary, _carry_in )
+
+    if not _binary:
+        dst, src = numpy.zeros_like( dst ), dst
+
+    if _family == "ABCD":
+        binary = dst + src + x
+
+        # the binary carries out of bits 3 and 7, and the decimal ones: a
+        # digit over 9 carries once 6 is added to it
+        carries  = ( ( src & dst ) | ( ~binary & dst ) | ( src & ~binary ) ) & 0x88
+        carries |= ( ( ( binary + 0x66 ) ^ binary ) & 0x110 ) >> 1
+
+        result   = binary + carries - ( carries >> 2 ) # 0x08 -> 0x06, 0x80 -> 0x60
+        carry    = ( ( carries | ( binary & ~result ) ) & 0x80 ) != 0
+        overflow = ( ~binary & result & 0x80 ) != 0
+    else:
+        binary = dst - src - x
+
+        # the borrows into bits 3 and 7
+        borrows = ( ( ~dst & src ) | ( binary & ~dst ) | ( binary & src ) ) & 0x88
+
+        result   = binary - borrows + ( borrows >> 2 )
+        carry    = ( ( borrows | ( ~binary & result ) ) & 0x80 ) != 0
+        overflow = ( binary & ~result & 0x80 ) != 0
+
+    result = result & 0xFF
+    flags  = carry * ( CCR_BITS["X"] | CCR_BITS["C"] ) \
+           + overflow * CCR_BITS["V"] \
+           + ( result == 0 ) * CCR_BITS["Z"] \
+           + ( ( result & 0x80 ) != 0 ) * CCR_BITS["N"]
+
+    return ( result | ( flags << 8 ) ).astype( numpy.uint16 )
+#}}}
+
+def bcd_tables():#{{{
+    """Returns ( tag, array ) artifact sections for every family in BCD_TABLES"""
+    return [ ( tag, alu_table( family, binary, True, bcd_reference, bcd_numpy, True ) ) for tag, family, binary in BCD_TABLES ]
+#}}}
+
+#**************************
+#
+# MOVEM register lists
+#
+#**************************
+
+# MOVEM is followed by a 16 bit register list mask.  Rather than scanning
+# it a bit at a time, the emulator can look up the registers it names, in
+# the order they are transferred, as register numbers 0-15 (D0-D7, A0-A7):
+#
+#     count     = MVCN[ mask ]
+#     start     = MVOF[ mask ]
+#     registers = MVRN[ start : start + count ]     every other mode
+#     registers = MVRP[ start : start + count ]     -(An)
+#
+# Normally bit 0 of the mask is D0 and bit 15 is A7, and the registers go
+# from D0 up to A7.  With -(An) the mask is the other way around (bit 0 is
+# A7), and the registers go from A7 down to D0.  Either way a mask names
+# the same number of registers, so both lists share the offsets.
+
+def movem_tables():#{{{
+    """Returns the offsets, counts, normal order and predecrement order arrays for every register list mask"""
+    offsets      = array( "I", bytes( 4 * ( 2**16 + 1 ) ) )
+    counts       = array( "B", bytes( 2**16 ) )
+    normal       = array( "B" )
+    predecrement = array( "B" )
+
+    for mask in range( 2**16 ):
+        registers = [ bit for bit in range( 16 ) if mask >> bit & 1 ]
+
+        offsets[ mask ] = len( normal )
+        counts[ mask ]  = len( registers )
+        normal.extend( registers )
+        predecrement.extend( 15 - bit for bit in registers )
+
+    offsets[ 2**16 ] = len( normal )
+
+    return offsets, counts, normal, predecrement
+#}}}
+
+#**************************
+#
+# Bitfield tables
+#
+#**************************
+
+# A bitfield in memory starts at bit ( offset mod 8 ) of the byte at
+# ( address + floor( offset / 8 ) ), counting from the most significant bit,
+# and is 1 to 32 bits wide, so it touches 1 to 5 bytes.  For each of the
+# 8 x 32 ( offset mod 8, width ) pairs these tables give how many bytes that
+# is, how far to shift those bytes (read as one big-endian number) right to
+# get the field, and which bits of each byte belong to the field:
+#
+#     i     = ( offset & 7 ) * 32 + ( ( width - 1 ) & 31 )   a width of 0 means 32
+#     bytes = BFSP[ i ]
+#     field = ( those bytes >> BFSH[ i ] ) & BFVM[ width & 31 ]
+#     BFMK[ i * 5 + n ] is the mask for byte n, 0 past the end
+#
+# BFFFO then finds the first set bit of the field a byte at a time, with
+# BFFO[ byte ], the number of the first set bit counting from the most
+# significant, or 8 if there are none.
+
+def bitfield_tables():#{{{
+    """Returns the span, shift, byte mask and value mask arrays for every ( offset mod 8, width ) pair"""
+    spans  = array( "B" )
+    shifts = array( "B" )
+    masks  = array( "B" )
+
+    for offset in range( 8 ):
+        for width in range( 1, 33 ):
+            span  = ( offset + width + 7 ) // 8
+            shift = span * 8 - offset - width
+            mask  = ( ( 1 << width ) - 1 ) << shift
+
+            spans.append( span )
+            shifts.append( shift )
+            masks.extend( ( mask >> ( 8 * ( span - 1 - n ) ) ) & 0xFF if n < span else 0 for n in range( 5 ) )
+
+    # indexed by the width field itself, 0 meaning 32, so that nothing has to
+    # shift by 32 to make the mask
+    values = array( "I", [ 0xFFFFFFFF ] + [ ( 1 << width ) - 1 for width in range( 1, 32 ) ] )
+
+    return spans, shifts, masks, values
+#}}}
+
+def first_one_table():#{{{
+    """Returns the position of the first set bit of each byte, from the most significant, or 8 for 0"""
+    return array( "B", [ 8 ] + [ 8 - b.bit_length() for b in range( 1, 256 ) ] )
+#}}}
+
+#**************************
+#
+# Shift and rotate tables
+#
+#**************************
+
+# A shift or rotate count is 1-8 when it's in the opcode (where 0 means 8),
+# and 0-63 when it comes from a register (its value mod 64).  Everything the
+# flags need from the count can then be looked up by ( size, count ), with
+# the size as it is in the operand words (0 byte, 1 word, 2 long):
+#
+#     count   = SHIM[ count field ]                            immediate counts
+#     i       = size * 64 + count
+#     n       = SHEC[ kind * 192 + i ]                         the count that actually matters
+#     result &= SHRM[ size ]
+#     C       = ( operand & SHCM[ kind * 192 + i ] ) != 0      if the mask is 0, C is cleared,
+#                                                             or for ROXL/ROXR, C = X
+#     V       = ( operand & SHVM[ i ] ) not 0 and not SHVM[ i ]   ASL only; the rest clear V
+#     cycles += SHCY[ count ]                                  register counts only
+#
+# where kind is the index in SHIFT_KINDS.  The cycles for an immediate count
+# are already in CYCL, so SHCY is only needed when the count is in a register
+# (and CYCL has TIMING_DEPENDS set).  The masks apply to the operand
+# before it's shifted.  For the shifts, n is the count clamped to the size,
+# since the result is the same (0, or all sign bits for ASR) from there on;
+# rotates only need the count mod the size, or mod the size plus one for
+# ROXL/ROXR, which rotate through X.  The one thing the tables can't say
+# is that an ASL by the size or more sets V for any operand but 0, including
+# one that is all ones.
+
+SHIFT_KINDS = [ "ASL", "ASR", "LSL", "LSR", "ROXL", "ROXR", "ROL", "ROR" ]
+SHIFT_SIZES = [ 8, 16, 32 ]
+
+# the count of each immediate count field, where 0 means 8
+SHIFT_IMMEDIATES = [ 8, 1, 2, 3, 4, 5, 6, 7 ]
+
+def shift_count( _kind, _bits, _count ):#{{{
+    """Returns the count that a shift or rotate of _bits by _count acts like"""
+    if _kind in ( "ROL", "ROR" ):
+        return _count % _bits
+    if _kind in ( "ROXL", "ROXR" ):
+        return _count % ( _bits + 1 )
+
+    return min( _count, _bits )
+#}}}
+
+def carry_bit( _kind, _bits, _count ):#{{{
+    """Returns the bit of the operand that ends up in C after a shift or rotate, or None if C isn't from the operand"""
+    if _count == 0:
+        return None
+
+    if _kind in ( "ASL", "LSL" ):
+        return _bits - _count if _count <= _bits else None
+    if _kind == "LSR":
+        return _count - 1 if _count <= _bits else None
+    if _kind == "ASR":
+        return min( _count, _bits ) - 1
+    if _kind == "ROL":
+        return ( _bits - _count ) % _bits
+    if _kind == "ROR":
+        return ( _count - 1 ) % _bits
+
+    count = _count % ( _bits + 1 )
+    if count == 0:
+        return None # C = X
+    if _kind == "ROXL":
+        return _bits - count
+
+    return count - 1 # ROXR
+#}}}
+
+def shift_tables():#{{{
+    """Returns the SHIM, SHEC, SHRM, SHCM, SHVM and SHCY arrays"""
+    immediates = array( "B", SHIFT_IMMEDIATES )
+    results    = array( "I", [ ( 1 << bits ) - 1 for bits in SHIFT_SIZES ] )
+    counts     = array( "B" )
+    carries    = array( "I" )
+    overflows  = array( "I" )
+
+    for kind in SHIFT_KINDS:
+        for bits in SHIFT_SIZES:
+            for count in range( 64 ):
+                bit = carry_bit( kind, bits, count )
+                counts.append( shift_count( kind, bits, count ) )
+                carries.append( 0 if bit == None else 1 << bit )
+
+    # ASL sets V if the most significant bit changes at any point, which is
+    # when the top count + 1 bits aren't all the same.  (Once the count
+    # reaches the size, that's whenever the operand isn't 0, even all ones.)
+    for bits in SHIFT_SIZES:
+        for count in range( 64 ):
+            top = min( count + 1, bits ) if count else 0
+            overflows.append( ( ( 1 << top ) - 1 ) << ( bits - top ) )
+
+    # on top of the 6 (8 for long) in CYCLES, each bit of a shift or rotate
+    # by a register takes another 2 cycles
+    cycles = array( "B", [ SHIFT_CYCLES_PER_BIT * count for count in range( 64 ) ] )
+
+    return immediates, counts, results, carries, overflows, cycles
+#}}}
+
+#**************************
+#
+# Multiply and divide timing
+#
+#**************************
+
+# MULU_WORD, MULS_WORD, DIVU_WORD and DIVS_WORD are in TIMED_AT_RUNTIME,
+# because their time depends on the operands.  These tables give their
+# execution time in full, to use instead of the base from CYCLES (the EA
+# calculation time still goes on top):
+#
+#     MULU[ source ]     38 + 2n, n the number of ones in the source
+#     MULS[ source ]     38 + 2n, n the number of 01 or 10 pairs in the
+#                        source with a 0 after its lowest bit
+#     DIVU[ quotient ]   for a DIVU that doesn't overflow
+#     DIVS[ |quotient| ] for a DIVS that doesn't overflow, with a dividend
+#                        and divisor that aren't negative; add 6 when only
+#                        the dividend is negative, 2 when only the divisor
+#                        is, and 4 when both are
+#
+# The divide times come from how the 68000 works out a quotient a bit at a
+# time: each of the top 15 bits of the quotient costs 4 cycles if it's 0
+# and 2 if it's 1.  That is exact for DIVS.  DIVU also skips the compare
+# for any step where the partial remainder has its top bit set, which
+# only happens with a divisor of 0x8000 or more; the table ignores that,
+# so with such divisors DIVU can really be up to 30 cycles quicker than
+# it says.  A divide that overflows stops early, after DIVU_OVERFLOW_CYCLES
+# or DIVS_OVERFLOW_CYCLES (2 more for DIVS with a negative dividend).
+
+DIVU_OVERFLOW_CYCLES = 10
+DIVS_OVERFLOW_CYCLES = 16
+
+def quotient_zeros( _quotient ):#{{{
+    """Returns the number of 0s in the top 15 bits of a 16 bit quotient"""
+    return 15 - bin( ( _quotient >> 1 ) & 0x7FFF ).count( "1" )
+#}}}
+
+def multiply_divide_tables():#{{{
+    """Returns the MULU, MULS, DIVU and DIVS timing arrays"""
+    mulu = array( "B", [ 38 + 2 * bin( source ).count( "1" ) for source in range( 2**16 ) ] )
+    muls = array( "B", [ 38 + 2 * bin( ( source ^ ( source << 1 ) ) & 0xFFFF ).count( "1" ) for source in range( 2**16 ) ] )
+    divu = array( "B", [ 2 * ( 53 + quotient_zeros( quotient ) ) for quotient in range( 2**16 ) ] )
+    divs = array( "B", [ 2 * ( 60 + quotient_zeros( quotient ) ) for quotient in range( 2**16 ) ] )
+
+    return mulu, muls, divu, divs
+#}}}
+
+#**************************
+#
+# Binary artifact
+#
+#**************************
+
+# --binary PATH writes the table in a form that ae.js can fetch() into an
+# ArrayBuffer and use as it is, with no parsing beyond the header.  All of the
+# numbers are little-endian.
+#
+#     offset  size  contents
+#          0     4  magic, "AELT"
+#          4     2  format version (ARTIFACT_VERSION)
+#          6     2  entry width of the OPID section, in bytes
+#          8     2  family count, including id 0
+#         10     2  section count
+#         12    20  SHA-1 of the genlut.py that wrote the file
+#         32  16*n  section directory, one entry per section:
+#                       4  tag, e.g. "OPID"
+#                       1  element type, as an array typecode ("B", "h", "I", ...)
+#                       3  padding
+#                       4  byte offset of the section from the start of the file
+#                       4  element count
+#
+# Every section starts on an 8 byte boundary, so it can be wrapped directly
+# in a typed array.  These sections are always there:
+#
+#     OPID  H  the family id of each of the 65536 opcodes
+#     FAMS  B  the family table: for each id in turn, its major opcode (255
+#              if it has none), the length of its name, and the name in ASCII
+#     RUNS  H  the runs from runs(), flattened to start, end, id triples
+#     UNAS  H  the runs from unassigned_ranges(), flattened to start, end,
+#              class triples, where the class indexes TRAP_CLASSES
+#     PIDX  H  the first level index from pages(); its length gives the page size
+#     PAGE  B  the unique pages from pages() (H once there are over 255 families)
+#     OPND  I  the packed operand word of each opcode, from operands()
+#     HNDL  H  the specialized handler id of each opcode, from handlers()
+#     HMAN  B  the handler manifest, as family id, size, opmode, source EA class
+#              and destination EA class for each handler id from 1 up
+#     ILEN  B  the length in words of each instruction, from lengths()
+#     CYCL  H  the base 68000 cycle count of each instruction, from timings()
+#     CCRF  H  the CCR flags each instruction reads and writes, from ccr_effects(),
+#              with CCR_MAY_TRAP set in the reads if it can take an exception
+#     COND  B  whether each condition holds in each CCR state, 16 rows of 32,
+#              from condition_table()
+#     CMSK  H  the conditions that hold in each of the 32 CCR states, one bit
+#              per condition, from condition_masks()
+#     XBIT  B  for each family id, the extension word bit that picks its
+#              variant, or 255 if it has none (see variant_tables())
+#     XVAR  B  the variant ids, two per family id, for bit values 0 and 1
+#     XNAM  B  the variant names, as a length and the name in ASCII per id
+#     XDSC  H  the extension word descriptor of each family id, EXTENSION_STRIDE
+#              values apiece (see extension_tables())
+#     XTAB  I  the secondary tables of every family with an extension word,
+#              laid out as EXTENSION_FIELDS
+#     MVOF  I  the offset of each register list mask's registers in MVRN and
+#              MVRP, plus one more for the end, from movem_tables()
+#     MVCN  B  the number of registers each register list mask names
+#     MVRN  B  the registers of every mask, in normal order
+#     MVRP  B  the registers of every mask, in predecrement order
+#     BFSP  B  the number of bytes each bitfield touches, from bitfield_tables()
+#     BFSH  B  how far right to shift those bytes to get the field
+#     BFMK  B  the mask of each of those bytes, five per bitfield
+#     BFVM  I  the value mask of each width field (0 meaning 32)
+#     BFFO  B  the first set bit of each byte, for BFFFO, from first_one_table()
+#     SHIM  B  the count of each immediate shift count field, from shift_tables()
+#     SHEC  B  the count each shift or rotate acts like, by kind, size and count
+#     SHRM  I  the result mask of each size
+#     SHCM  I  the operand bit that ends up in C, by kind, size and count
+#     SHVM  I  the operand bits that decide V for ASL, by size and count
+#     SHCY  B  the extra cycles of a shift or rotate by a register, by count
+#     MULU  B  the MULU_WORD time for each source, from multiply_divide_tables()
+#     MULS  B  the MULS_WORD time for each source
+#     DIVU  B  the DIVU_WORD time for each quotient
+#     DIVS  B  the DIVS_WORD time for each absolute quotient
+#     ADDB  H  the byte ALU tables from alu_tables(), each entry the result
+#     SUBB     byte and the CCR flags it sets, indexed as ALU_TABLES says
+#     CMPB
+#     ADXB
+#     SBXB
+#     NEGB
+#     NGXB
+#     ABCD  H  the BCD tables from bcd_tables(), laid out like the ALU tables
+#     SBCD     and indexed as BCD_TABLES says
+#     NBCD
+
+ARTIFACT_MAGIC   = b"AELT"
+ARTIFACT_VERSION = 1
+
+def source_hash():#{{{
+    """Returns the SHA-1 digest of this script"""
+    with open( os.path.abspath( __file__ ), "rb" ) as f:
+        return hashlib.sha1( f.read() ).digest()
+#}}}
+
+def family_table():#{{{
+    """Packs the FAMILIES table for the FAMS section"""
+    table = array( "B" )
+
+    for family in FAMILIES:
+        name = ( family["name"] or "" ).encode( "ascii" )
+        table.append( 255 if family["major"] == None else family["major"] )
+        table.append( len( name ) )
+        table.frombytes( name )
+
+    return table
+#}}}
+
+def write_artifact( _path, _sections ):#{{{
+    """Writes a binary artifact from a list of ( tag, array ) sections"""
+    header_size = 32 + 16 * len( _sections )
+    directory   = b""
+    body        = b""
+
+    for tag, data in _sections:
+        offset = header_size + len( body )
+        offset = ( offset + 7 ) & ~7
+        body  += b"\0" * ( offset - header_size - len( body ) )
+
+        directory += struct.pack( "<4sc3xII", tag.encode( "ascii" ), data.typecode.encode( "ascii" ), offset, len( data ) )
+
+        if sys.byteorder == "big":
+            data = array( data.typecode, data )
+            data.byteswap()
+        body += data.tobytes()
+
+    header = struct.pack( "<4sHHHH20s", ARTIFACT_MAGIC, ARTIFACT_VERSION, 2, len( FAMILIES ), len( _sections ), source_hash() )
+
+    with open( _path, "wb" ) as f:
+        f.write( header + directory + body )
+#}}}
+
+def dump( _table ):#{{{
+    """Prints every assigned opcode in a table of family ids"""
+    for i in range(len(_table)):
+        if _table[i] != 0:
+            print( "{:016b} = 0x{:04X} = {:5d} -> {:s}".format( i, i, i, FAMILIES[ _table[i] ]["name"] ) )
+#}}}
+
+def main( _argv ):#{{{
+    parser = argparse.ArgumentParser( description="Generate a LUT for all 68k opcodes" )
+    parser.add_argument( "--backend", choices=[ "python", "numpy" ], default="python",
+            help="build the table with plain Python, or with NumPy arrays" )
+    parser.add_argument( "--cache", metavar="DIR",
+            help="keep expanded families in DIR and only regenerate the ones that changed (python backend)" )
+    parser.add_argument( "--jobs", metavar="N", type=int,
+            help="expand the families in a pool of N processes (python backend)" )
+    parser.add_argument( "--overlaps", action="store_true",
+            help="only check the templates for overlapping opcodes, and list every overlap" )
+    parser.add_argument( "--binary", metavar="PATH",
+            help="write the table to PATH as a binary artifact for ae.js, instead of printing it" )
+    parser.add_argument( "--dump", action="store_true",
+            help="print one line per assigned opcode, rather than one line per run of opcodes" )
+    parser.add_argument( "--handlers", action="store_true",
+            help="print the manifest of specialized handlers instead of the table" )
+    parser.add_argument( "--unassigned", action="store_true",
+            help="only list the unassigned opcodes by the exception they raise, without expanding the table" )
+    parser.add_argument( "--page-bits", metavar="N", type=int, choices=[ 4, 8 ], default=8,
+            help="split the paged table in the binary artifact on the top N bits (4 or 8)" )
+    args = parser.parse_args( _argv )
+
+    if args.backend == "numpy" and numpy == None:
+        parser.error( "the numpy backend requires NumPy to be installed" )
+
+    if args.cache != None and args.backend != "python":
+        parser.error( "--cache only works with the python backend" )
+
+    if args.jobs != None and ( args.backend != "python" or args.cache != None ):
+        parser.error( "--jobs only works with the python backend, without --cache" )
+
+    # Check all of the templates against each other before expanding any of
+    # them, so that every bad template shows up in a single run.  (The counts
+    # assume no family overlaps itself; if one does, that is listed too.)
+    overlaps = find_overlaps()
+    report_overlaps( overlaps )
+
+    # and make sure every family says what it does to the condition codes
+    undeclared = undeclared_ccr_effects()
+    for name in undeclared:
+        sys.stderr.write( "%s has no entry in CCR_EFFECTS\n" % name )
+
+    if args.overlaps or overlaps or undeclared:
+        sys.exit( 1 if overlaps or undeclared else 0 )
+
+    if args.unassigned:
+        unassigned_listing( unassigned_ranges() )
+        return
+
+    if args.backend == "numpy":
+        table = array( ID_TYPECODE, gen_numpy_table().tolist() )
+
+    elif args.cache != None:
+        changed = gen_cached( args.cache )
+        sys.stderr.write( "regenerated %d of %d families\n" % ( len( changed ), len( FAMILIES ) - 1 ) )
+        table = INSTRUCTIONS
+
+    elif args.jobs != None:
+        gen_parallel( args.jobs )
+        table = INSTRUCTIONS
+
+    else:
+        for op in OPCODES:
+            if op != None:
+                gen( OPCODES[op], op )
+        table = INSTRUCTIONS
+
+    if args.binary != None or args.handlers:
+        words                 = operands( table )
+        handler_ids, manifest = handlers( table, words )
+
+    if args.binary != None:
+        index, data = pages( table, args.page_bits )
+        report_pages( table, index, data )
+
+        variant_bits, variants  = variant_tables()
+        descriptors, extensions = extension_tables()
+        movem_offsets, movem_counts, movem_normal, movem_predecrement = movem_tables()
+        bitfield_spans, bitfield_shifts, bitfield_masks, bitfield_values = bitfield_tables()
+        shift_immediates, shift_counts, shift_results, shift_carries, shift_overflows, shift_cycles = shift_tables()
+        mulu, muls, divu, divs = multiply_divide_tables()
+
+        write_artifact( args.binary, [ ( "OPID", array( "H", table ) ),
+                                       ( "FAMS", family_table() ),
+                                       ( "RUNS", array( "H", [ n for run in runs( table ) for n in run ] ) ),
+                                       ( "UNAS", array( "H", [ n for run in unassigned_ranges() for n in run ] ) ),
+                                       ( "PIDX", index ),
+                                       ( "PAGE", data ),
+                                       ( "OPND", words ),
+                                       ( "HNDL", handler_ids ),
+                                       ( "HMAN", array( "B", [ n for key in manifest for n in key ] ) ),
+                                       ( "ILEN", lengths( table, words ) ),
+                                       ( "CYCL", timings( table, words ) ),
+                                       ( "CCRF", ccr_effects( table, words ) ),
+                                       ( "COND", condition_table() ),
+                                       ( "CMSK", condition_masks() ),
+                                       ( "XBIT", variant_bits ),
+                                       ( "XVAR", variants ),
+                                       ( "XNAM", variant_names() ),
+                                       ( "XDSC", descriptors ),
+                                       ( "XTAB", extensions ),
+                                       ( "MVOF", movem_offsets ),
+                                       ( "MVCN", movem_counts ),
+                                       ( "MVRN", movem_normal ),
+                                       ( "MVRP", movem_predecrement ),
+                                       ( "BFSP", bitfield_spans ),
+                                       ( "BFSH", bitfield_shifts ),
+                                       ( "BFMK", bitfield_masks ),
+                                       ( "BFVM", bitfield_values ),
+                                       ( "BFFO", first_one_table() ),
+                                       ( "SHIM", shift_immediates ),
+                                       ( "SHEC", shift_counts ),
+                                       ( "SHRM", shift_results ),
+                                       ( "SHCM", shift_carries ),
+                                       ( "SHVM", shift_overflows ),
+                                       ( "SHCY", shift_cycles ),
+                                       ( "MULU", mulu ),
+                                       ( "MULS", muls ),
+                                       ( "DIVU", divu ),
+                                       ( "DIVS", divs ) ] + alu_tables() + bcd_tables() )
+    elif args.handlers:
+        handler_listing( manifest )
+    elif args.dump:
+        dump( table )
+    else:
+        listing( runs( table ) )
+#}}}
 
-for i in range(len(INSTRUCTIONS)):
-    if INSTRUCTIONS[i] != None:
-        print( "{:016b} = 0x{:04X} = {:5d} -> {:s}".format( i, i, i, INSTRUCTIONS[i] ) )
+if __name__ == "__main__":
+    main( sys.argv[1:] )
 
 # vim: set foldmethod=marker: